@@ -0,0 +1,57 @@
+"""unique room names per dorm and bed names per room
+
+Revision ID: 5b8e2c71d3fa
+Revises: 9d4f06e9eca0
+Create Date: 2026-10-19 16:02:51.734120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e2c71d3fa'
+down_revision: Union[str, None] = '9d4f06e9eca0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the unique indexes replace the ones on the name and on the parent alone
+UNIQUE_INDEXES = [
+    ('ix_room_dorm_id_name', 'room', ['dorm_id', 'name']),
+    ('ix_bed_room_id_name', 'bed', ['room_id', 'name']),
+]
+REPLACED_INDEXES = [
+    ('ix_room_name', 'room', ['name']),
+    ('ix_room_dorm_id', 'room', ['dorm_id']),
+    ('ix_bed_name', 'bed', ['name']),
+    ('ix_bed_room_id', 'bed', ['room_id']),
+]
+
+
+def upgrade() -> None:
+    # a failed concurrent build leaves an invalid index behind, so check first
+    conn = op.get_bind()
+    for name, table, (parent, column) in UNIQUE_INDEXES:
+        duplicates = conn.execute(sa.text(
+            f"SELECT count(*) FROM (SELECT 1 FROM {table} GROUP BY {parent}, {column} HAVING count(*) > 1) AS d"
+        )).scalar()
+        if duplicates:
+            raise RuntimeError(f"{duplicates} {table} names are used more than once within their "
+                               f"{parent[:-3]}, rename them before upgrading")
+
+    # built without blocking writes to the live tables
+    with op.get_context().autocommit_block():
+        for name, table, columns in UNIQUE_INDEXES:
+            op.create_index(name, table, columns, unique=True, postgresql_concurrently=True)
+        for name, table, columns in REPLACED_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in REPLACED_INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+        for name, table, columns in reversed(UNIQUE_INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,46 @@
+"""create job queue
+
+Revision ID: 8d912d9546bb
+Revises: cab1d36a8093
+Create Date: 2026-10-19 10:04:17.552930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8d912d9546bb'
+down_revision: Union[str, None] = 'cab1d36a8093'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('job',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('type', sa.String(), nullable=False),
+    sa.Column('params', sa.JSON(), nullable=False),
+    sa.Column('status', sa.Enum('queued', 'running', 'succeeded', 'failed', 'cancelled', name='job_status'), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=True),
+    sa.Column('processed', sa.Integer(), nullable=True),
+    sa.Column('cursor', sa.String(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('actor', sa.String(), nullable=True),
+    sa.Column('client_id', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_id'), 'job', ['id'], unique=False)
+    op.create_index('ix_job_status_created_at', 'job', ['status', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_job_status_created_at', table_name='job')
+    op.drop_index(op.f('ix_job_id'), table_name='job')
+    op.drop_table('job')
+    op.execute(sa.text('DROP TYPE job_status'))
@@ -0,0 +1,113 @@
+"""add archive tables and partial indexes
+
+Revision ID: 9d4f06e9eca0
+Revises: db2d221ab63d
+Create Date: 2026-10-19 13:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# the types already exist, created with the live tables
+type = postgresql.ENUM(name='type', create_type=False)
+amount_type = postgresql.ENUM(name='amount_type', create_type=False)
+floor = postgresql.ENUM(name='floor', create_type=False)
+bed_type = postgresql.ENUM(name='bed_type', create_type=False)
+participant_type = postgresql.ENUM(name='participant_type', create_type=False)
+level = postgresql.ENUM(name='level', create_type=False)
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4f06e9eca0'
+down_revision: Union[str, None] = 'db2d221ab63d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('ix_dorm_created_at_active', 'dorm', ['created_at'], 'active = true'),
+    ('ix_dorm_updated_at_inactive', 'dorm', ['updated_at'], 'active = false'),
+    ('ix_room_dorm_id', 'room', ['dorm_id'], None),
+    ('ix_room_dorm_id_created_at_active', 'room', ['dorm_id', 'created_at'], 'active = true'),
+    ('ix_room_updated_at_inactive', 'room', ['updated_at'], 'active = false'),
+    ('ix_bed_room_id', 'bed', ['room_id'], None),
+    ('ix_bed_room_id_created_at_active', 'bed', ['room_id', 'created_at'], 'active = true'),
+    ('ix_bed_room_id_free', 'bed', ['room_id'], 'active = true AND blocked = false AND allocated = false'),
+    ('ix_bed_updated_at_inactive', 'bed', ['updated_at'], 'active = false'),
+]
+
+
+def upgrade() -> None:
+    op.create_table('dorm_archive',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('type', type, nullable=True),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('amount_for', amount_type, nullable=True),
+    sa.Column('active', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('room_archive',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('dorm_id', sa.UUID(), nullable=True),
+    sa.Column('room_identifier', sa.Integer(), nullable=True),
+    sa.Column('ac_available', sa.Boolean(), nullable=True),
+    sa.Column('floor', floor, nullable=True),
+    sa.Column('close_to_dorm_entrance', sa.Boolean(), nullable=True),
+    sa.Column('close_to_bath', sa.Boolean(), nullable=True),
+    sa.Column('percent_released', sa.Integer(), nullable=True),
+    sa.Column('bed_type', bed_type, nullable=True),
+    sa.Column('is_multibatch', sa.Boolean(), nullable=True),
+    sa.Column('max_count', sa.Integer(), nullable=True),
+    sa.Column('participant_type', participant_type, nullable=True),
+    sa.Column('reset_allowed', sa.Boolean(), nullable=True),
+    sa.Column('active', sa.Boolean(), nullable=True),
+    sa.Column('bed_count', sa.Integer(), nullable=True),
+    sa.Column('allocated_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_room_archive_dorm_id', 'room_archive', ['dorm_id'], unique=False)
+    op.create_table('bed_archive',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('room_id', sa.UUID(), nullable=True),
+    sa.Column('number', sa.Integer(), nullable=True),
+    sa.Column('blocked', sa.Boolean(), nullable=True),
+    sa.Column('level', level, nullable=True),
+    sa.Column('close_to_dorm_entrance', sa.Boolean(), nullable=True),
+    sa.Column('close_to_bath', sa.Boolean(), nullable=True),
+    sa.Column('allocated', sa.Boolean(), nullable=True),
+    sa.Column('active', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_bed_archive_room_id', 'bed_archive', ['room_id'], unique=False)
+
+    # built without blocking writes to the live tables
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True,
+                            postgresql_where=sa.text(where) if where else None, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+    op.drop_index('ix_bed_archive_room_id', table_name='bed_archive')
+    op.drop_table('bed_archive')
+    op.drop_index('ix_room_archive_dorm_id', table_name='room_archive')
+    op.drop_table('room_archive')
+    op.drop_table('dorm_archive')
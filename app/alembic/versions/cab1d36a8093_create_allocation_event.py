@@ -0,0 +1,55 @@
+"""create allocation event log
+
+Revision ID: cab1d36a8093
+Revises: 4ecb8509214a
+Create Date: 2026-10-19 09:12:41.308215
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'cab1d36a8093'
+down_revision: Union[str, None] = '4ecb8509214a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('allocation_event',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=False), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('bed_id', sa.UUID(), nullable=False),
+    sa.Column('room_id', sa.UUID(), nullable=False),
+    sa.Column('actor', sa.String(), nullable=True),
+    sa.Column('client_id', sa.String(), nullable=True),
+    sa.Column('from_allocated', sa.Boolean(), nullable=True),
+    sa.Column('to_allocated', sa.Boolean(), nullable=True),
+    sa.Column('from_blocked', sa.Boolean(), nullable=True),
+    sa.Column('to_blocked', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.create_index('ix_allocation_event_bed_id_created_at', 'allocation_event', ['bed_id', 'created_at'], unique=False)
+    op.create_index('ix_allocation_event_room_id_created_at', 'allocation_event', ['room_id', 'created_at'], unique=False)
+
+    # rows outside the monthly partitions land here instead of failing the write
+    op.execute(sa.text('CREATE TABLE allocation_event_default PARTITION OF allocation_event DEFAULT'))
+    today = date.today()
+    for i in range(3):
+        month = today.month - 1 + i
+        lower = date(today.year + month // 12, month % 12 + 1, 1)
+        upper = date(today.year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+        op.execute(sa.text(
+            f"CREATE TABLE allocation_event_{lower:%Y_%m} PARTITION OF allocation_event "
+            f"FOR VALUES FROM ('{lower:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_allocation_event_room_id_created_at', table_name='allocation_event')
+    op.drop_index('ix_allocation_event_bed_id_created_at', table_name='allocation_event')
+    # dropping the parent drops all partitions
+    op.drop_table('allocation_event')
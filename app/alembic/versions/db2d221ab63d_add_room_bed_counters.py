@@ -0,0 +1,36 @@
+"""add room bed counters
+
+Revision ID: db2d221ab63d
+Revises: 8d912d9546bb
+Create Date: 2026-10-19 11:21:09.840127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'db2d221ab63d'
+down_revision: Union[str, None] = '8d912d9546bb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('room', sa.Column('bed_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('room', sa.Column('allocated_count', sa.Integer(), server_default='0', nullable=False))
+    # backfill from the existing beds, active beds only
+    op.execute(sa.text('''
+        UPDATE room SET bed_count = counts.beds, allocated_count = counts.allocated
+        FROM (
+            SELECT room_id, count(*) AS beds, count(*) FILTER (WHERE allocated) AS allocated
+            FROM bed WHERE active IS NOT FALSE GROUP BY room_id
+        ) AS counts
+        WHERE room.id = counts.room_id
+    '''))
+
+
+def downgrade() -> None:
+    op.drop_column('room', 'allocated_count')
+    op.drop_column('room', 'bed_count')
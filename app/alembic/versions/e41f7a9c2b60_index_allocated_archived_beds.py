@@ -0,0 +1,31 @@
+"""index allocated archived beds
+
+Revision ID: e41f7a9c2b60
+Revises: 5b8e2c71d3fa
+Create Date: 2026-10-19 17:21:08.402519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41f7a9c2b60'
+down_revision: Union[str, None] = '5b8e2c71d3fa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_bed_archive_room_id_allocated', 'bed_archive', ['room_id'], unique=False,
+                        postgresql_concurrently=True, postgresql_where=sa.text('allocated = true'),
+                        if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_bed_archive_room_id_allocated', table_name='bed_archive',
+                      postgresql_concurrently=True, if_exists=True)
@@ -5,6 +5,11 @@ from config.db import check_db_connection
 from api.dorm import router as dorm_router
 from api.room import router as room_router
 from api.bed import router as bed_router
+from api.availability import router as availability_router
+from api.report import router as report_router
+from api.job import router as job_router
+from api.release import router as release_router
+from api.archive import router as archive_router
 
 router = APIRouter()
 load_dotenv()
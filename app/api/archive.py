@@ -0,0 +1,86 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Security
+from fastapi.security import APIKeyHeader
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, select
+import uuid
+
+from schema import PaginatedArchivedDormResponse, RestoreResponse
+from models import DormArchive
+from config.db import get_db
+from deps import is_authenticated
+from cache import dorm_tree_cache
+from archive import ArchiveConflict, restore
+
+router = APIRouter()
+authorization_token = APIKeyHeader(name='Authorization', scheme_name='Authorization')
+x_client_id = APIKeyHeader(name='X-Client-Id', scheme_name='X-Client-Id')
+
+@router.get("/dorms/", response_model=PaginatedArchivedDormResponse, status_code=status.HTTP_200_OK)
+def list_archived_dorms(
+    db: Session = Depends(get_db),
+    page_size: int = Query(20, gt=0, le=100),
+    page: int = Query(1, gt=0),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    List the archived dorms, most recently archived first
+    '''
+    count = db.execute(select(func.count()).select_from(DormArchive)).scalar()
+    dorms = db.execute(select(DormArchive).order_by(DormArchive.c.archived_at.desc())
+                       .offset((page-1)*page_size).limit(page_size)).all()
+    return {"count": count, "results": dorms}
+
+def _restore(db, level, id):
+    try:
+        dorm_id, restored = restore(db, level, id)
+        db.commit()
+    except LookupError as e:
+        db.rollback()
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ArchiveConflict as e:
+        db.rollback()
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=str(e))
+    except IntegrityError as e:
+        # e.g. the name of the dorm was taken again in the meantime
+        db.rollback()
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=str(e.orig))
+    dorm_tree_cache.delete(str(dorm_id))
+    return restored
+
+@router.post("/dorms/{dorm_id}/restore/", response_model=RestoreResponse, status_code=status.HTTP_200_OK)
+def restore_dorm(
+    dorm_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Restore an archived dorm with its archived rooms and beds
+    '''
+    return _restore(db, 'dorm', dorm_id)
+
+@router.post("/rooms/{room_id}/restore/", response_model=RestoreResponse, status_code=status.HTTP_200_OK)
+def restore_room(
+    room_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Restore an archived room with its archived beds
+    '''
+    return _restore(db, 'room', room_id)
+
+@router.post("/beds/{bed_id}/restore/", response_model=RestoreResponse, status_code=status.HTTP_200_OK)
+def restore_bed(
+    bed_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Restore an archived bed
+    '''
+    return _restore(db, 'bed', bed_id)
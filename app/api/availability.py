@@ -0,0 +1,72 @@
+from fastapi import APIRouter, Depends, status, Query, Security
+from fastapi.security import APIKeyHeader
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+import uuid
+
+from schema import AvailableBedsResponse
+from models import Bed, Dorm, Room
+from config.db import get_db
+from deps import is_authenticated
+from availability import get_index, ROOM_ATTRIBUTES, BED_ATTRIBUTES
+from quota import remaining_beds_expression
+
+router = APIRouter()
+authorization_token = APIKeyHeader(name='Authorization', scheme_name='Authorization')
+x_client_id = APIKeyHeader(name='X-Client-Id', scheme_name='X-Client-Id')
+
+@router.get("/beds/", response_model=AvailableBedsResponse, status_code=status.HTTP_200_OK)
+def find_free_beds(
+    dorm_id: Optional[uuid.UUID] = Query(None),
+    room_id: Optional[uuid.UUID] = Query(None),
+    level: Optional[Bed.LEVELS] = Query(None),
+    close_to_bath: Optional[bool] = Query(None),
+    close_to_dorm_entrance: Optional[bool] = Query(None),
+    ac_available: Optional[bool] = Query(None),
+    floor: Optional[Room.FLOORS] = Query(None),
+    bed_type: Optional[Room.BED_TYPES] = Query(None),
+    participant_type: Optional[Room.PARTICIPANT_TYPES] = Query(None),
+    room_close_to_bath: Optional[bool] = Query(None),
+    room_close_to_dorm_entrance: Optional[bool] = Query(None),
+    limit: int = Query(10, gt=0, le=100),
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Find candidate free beds within the released quota of their rooms.
+    Answered from the in-memory availability index when it is enabled,
+    otherwise from the database. Candidates are not reserved, the allocation
+    itself must still check the bed.
+    '''
+    filters = dict(level=level, close_to_bath=close_to_bath, close_to_dorm_entrance=close_to_dorm_entrance,
+                   ac_available=ac_available, floor=floor, bed_type=bed_type, participant_type=participant_type,
+                   room_close_to_bath=room_close_to_bath, room_close_to_dorm_entrance=room_close_to_dorm_entrance)
+
+    index = get_index()
+    if index is not None:
+        results = index.find(dorm_id=dorm_id, room_id=room_id, limit=limit, **filters)
+        return {"source": "index",
+                "results": [{"id": bed, "room_id": room, "dorm_id": dorm} for bed, room, dorm in results]}
+
+    # rank the free beds of each room so no room shows more than its released quota left
+    rank = func.row_number().over(partition_by=Bed.room_id, order_by=(Bed.number, Bed.id))
+    beds = db.query(Bed.id, Bed.room_id, Room.dorm_id, rank.label('rank'),
+                    remaining_beds_expression().label('remaining'))\
+        .join(Room, Bed.room_id==Room.id).join(Dorm, Room.dorm_id==Dorm.id)\
+        .filter(Bed.active==True, Bed.blocked==False, Bed.allocated==False,
+                Room.active==True, Dorm.active==True, remaining_beds_expression() > 0)
+    if dorm_id is not None:
+        beds = beds.filter(Room.dorm_id==dorm_id)
+    if room_id is not None:
+        beds = beds.filter(Bed.room_id==room_id)
+    for name, value in filters.items():
+        if value is not None:
+            column = ROOM_ATTRIBUTES.get(name, BED_ATTRIBUTES.get(name))
+            beds = beds.filter(column==value)
+    ranked = beds.subquery()
+    beds = db.query(ranked.c.id, ranked.c.room_id, ranked.c.dorm_id)\
+        .filter(ranked.c.rank <= ranked.c.remaining).limit(limit).all()
+    return {"source": "db",
+            "results": [{"id": bed, "room_id": room, "dorm_id": dorm} for bed, room, dorm in beds]}
@@ -1,14 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Security
+from fastapi.responses import JSONResponse
 from fastapi.security import APIKeyHeader
 from typing import List, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy import func, desc
 import uuid
 
-from schema import BedCreate, BedResponse, PaginatedBedResponse
-from models import Bed, Dorm, Room
+from schema import BedCreate, BedResponse, PaginatedBedResponse, PaginatedAllocationEventResponse, \
+    parse_columns, serialize_rows
+from models import AllocationEvent, Bed, Dorm, Room
 from config.db import get_db
 from deps import is_authenticated
+from cache import dorm_tree_cache
+from audit import bed_history
+from quota import released_beds
 
 router = APIRouter()
 authorization_token = APIKeyHeader(name='Authorization', scheme_name='Authorization')
@@ -22,12 +28,18 @@ def list_beds(
     page_size: int = Query(20, gt=0, le=100),
     page: int = Query(1, gt=0),
     active: Optional[bool] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,number,allocated"),
     is_authenticated = Depends(is_authenticated),
     authorization = Security(authorization_token),
     x_client_id = Security(x_client_id)):
     '''
     List all the beds for a room in a dorm
     '''
+    try:
+        columns = parse_columns(fields, BedResponse, Bed) if fields else None
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     # check if dorm and room exists
     dorm = db.query(Dorm).filter(Dorm.id==dorm_id).one_or_none()
     room = db.query(Room).filter(Room.id==room_id, Room.dorm_id==dorm_id).one_or_none()
@@ -37,15 +49,18 @@ def list_beds(
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Room not found')
 
     # get all beds for the room in the dorm
-    beds = db.query(Bed).filter(Bed.room_id==room_id).order_by(desc(Bed.created_at))
-    count = beds.count()
+    beds = (db.query(*columns) if columns else db.query(Bed))\
+        .filter(Bed.room_id==room_id).order_by(desc(Bed.created_at))
     
     # apply filters if any
     if active is not None:
         beds = beds.filter(Bed.active == active)
+    count = beds.count()
     
     # apply pagination
     beds = beds.slice((page-1)*page_size, page*page_size).all()
+    if columns:
+        return JSONResponse({"count": count, "results": serialize_rows(beds)})
     return {"count": count, "results": beds}
 
 @router.get("/{bed_id}/", response_model=BedResponse, status_code=status.HTTP_200_OK)
@@ -53,6 +68,7 @@ def read_bed(
     dorm_id: str,
     room_id: str,
     bed_id: str,
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,number,allocated"),
     db: Session = Depends(get_db),
     is_authenticated = Depends(is_authenticated),
     authorization = Security(authorization_token),
@@ -61,6 +77,11 @@ def read_bed(
     '''
     Get a bed by id
     '''
+    try:
+        columns = parse_columns(fields, BedResponse, Bed) if fields else None
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     # check if dorm and room exists
     dorm = db.query(Dorm).filter(Dorm.id==dorm_id).one_or_none()
     room = db.query(Room).filter(Room.id==room_id, Room.dorm_id==dorm_id).one_or_none()
@@ -70,13 +91,41 @@ def read_bed(
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Room not found')
 
     # get a bed
-    bed = db.query(Bed).filter(Bed.id==bed_id, Bed.room_id==room_id).one_or_none()
+    bed = (db.query(*columns) if columns else db.query(Bed))\
+        .filter(Bed.id==bed_id, Bed.room_id==room_id).one_or_none()
     if bed is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Bed not found')
+    if columns:
+        return JSONResponse(serialize_rows([bed])[0])
     return bed
 
-@router.post("/", response_model=BedResponse, status_code=status.HTTP_201_CREATED)
-def create_room(
+@router.get("/{bed_id}/history/", response_model=PaginatedAllocationEventResponse, status_code=status.HTTP_200_OK)
+def read_bed_history(
+    dorm_id: str,
+    room_id: str,
+    bed_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    page_size: int = Query(20, gt=0, le=100),
+    page: int = Query(1, gt=0),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    List the allocation events of a bed, latest first
+    '''
+    # check if the bed belongs to the room in the dorm
+    bed = db.query(Bed.id).join(Room, Bed.room_id==Room.id)\
+        .filter(Bed.id==bed_id, Bed.room_id==room_id, Room.dorm_id==dorm_id).one_or_none()
+    if bed is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Bed not found')
+
+    count = db.query(func.count(AllocationEvent.id)).filter(AllocationEvent.bed_id==bed_id).scalar()
+    events = bed_history(db, bed_id, offset=(page-1)*page_size, limit=page_size)
+    return {"count": count, "results": events}
+
+@router.post("/", response_model=BedResponse, status_code=status.HTTP_201_CREATED,
+             responses={status.HTTP_409_CONFLICT: {"description": "Bed already exists"}})
+def create_bed(
     dorm_id: uuid.UUID,
     room_id: uuid.UUID,
     bed: BedCreate,
@@ -89,24 +138,85 @@ def create_room(
     '''
     # check if dorm exists
     dorm = db.query(Dorm).filter(Dorm.id==dorm_id).one_or_none()
-    room = db.query(Room).filter(Room.id==room_id, Room.dorm_id==dorm_id).one_or_none()
     if dorm is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
+    # locked like in allocate_bed, a bed created allocated counts against the quota
+    room = db.query(Room).filter(Room.id==room_id, Room.dorm_id==dorm_id).with_for_update().one_or_none()
     if room is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Room not found')
-    
-    # check if bed already exists
-    existing_bed = db.query(Bed).filter(Bed.name==bed.name,
-                                        Bed.room_id==room_id).one_or_none()
-    if existing_bed is not None:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='Bed already exists')
+    if bed.allocated and bed.active and \
+            room.allocated_count + 1 > released_beds(room.bed_count + 1, room.percent_released):
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='No released beds left in this room')
 
-    # create bed
+    # create bed, the unique index on (room_id, name) rejects duplicates,
+    # also between concurrent requests
     try:
         db_item = Bed(**bed.model_dump(), room_id=room_id)
         db.add(db_item)
         db.commit()
-        db.refresh(db_item)
-    except Exception as e:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str('Bed already exists'))
+    except IntegrityError as e:
+        db.rollback()
+        if e.orig.diag.constraint_name == 'ix_bed_room_id_name':
+            raise HTTPException(status.HTTP_409_CONFLICT, detail='Bed already exists')
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e.orig))
+    db.refresh(db_item)
+    dorm_tree_cache.delete(str(dorm_id))
     return db_item
+
+@router.post("/{bed_id}/allocate/", response_model=BedResponse, status_code=status.HTTP_200_OK)
+def allocate_bed(
+    dorm_id: uuid.UUID,
+    room_id: uuid.UUID,
+    bed_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Allocate a bed, within the released quota of its room
+    '''
+    # the room row lock serializes allocations in the room, its counters decide the quota
+    room = db.query(Room).filter(Room.id==room_id, Room.dorm_id==dorm_id).with_for_update().one_or_none()
+    if room is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Room not found')
+    bed = db.query(Bed).filter(Bed.id==bed_id, Bed.room_id==room_id).with_for_update().one_or_none()
+    if bed is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Bed not found')
+    if bed.allocated or bed.blocked or bed.active is False:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='Bed is not available')
+    if room.allocated_count >= released_beds(room.bed_count, room.percent_released):
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='No released beds left in this room')
+
+    bed.allocated = True
+    db.commit()
+    db.refresh(bed)
+    dorm_tree_cache.delete(str(dorm_id))
+    return bed
+
+@router.post("/{bed_id}/release/", response_model=BedResponse, status_code=status.HTTP_200_OK)
+def release_bed(
+    dorm_id: uuid.UUID,
+    room_id: uuid.UUID,
+    bed_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Release an allocated bed
+    '''
+    # room before bed, in the same order as allocate_bed: the commit updates the room's counters
+    room = db.query(Room.id).filter(Room.id==room_id, Room.dorm_id==dorm_id).with_for_update().one_or_none()
+    if room is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Room not found')
+    bed = db.query(Bed).filter(Bed.id==bed_id, Bed.room_id==room_id).with_for_update().one_or_none()
+    if bed is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Bed not found')
+    if not bed.allocated:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='Bed is not allocated')
+
+    bed.allocated = False
+    db.commit()
+    db.refresh(bed)
+    dorm_tree_cache.delete(str(dorm_id))
+    return bed
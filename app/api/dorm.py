@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Security
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Security
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import APIKeyHeader
 from typing import List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import desc
+import hashlib
+import json
 import uuid
 
-from schema import DormPydanticRead, DormPydanticWrite, DormPydanticUpdate, PaginatedDormResponse
-from models import Dorm
+from schema import DormPydanticRead, DormPydanticWrite, DormPydanticUpdate, PaginatedDormResponse, \
+    DormTreeResponse, parse_fields, project, parse_columns, serialize_rows
+from models import Dorm, Room
 from config.db import get_db
+from cache import dorm_tree_cache
 from deps import is_authenticated
 
 router = APIRouter()
@@ -21,26 +26,34 @@ def list_dorms(
     page_size: int = Query(20, gt=0, le=100),
     page: int = Query(1, gt=0),
     active: Optional[bool] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,active"),
     is_authenticated = Depends(is_authenticated),
     authorization = Security(authorization_token),
     x_client_id = Security(x_client_id)):
     '''
     List all the dorms
     '''
+    try:
+        columns = parse_columns(fields, DormPydanticRead, Dorm) if fields else None
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     # apply filters if any
-    dorms = db.query(Dorm).order_by(desc(Dorm.created_at))
-    count = dorms.count()
+    dorms = (db.query(*columns) if columns else db.query(Dorm)).order_by(desc(Dorm.created_at))
     if active is not None:
         dorms = dorms.filter(Dorm.active == active)
+    count = dorms.count()
 
     # apply pagination
     dorms = dorms.slice((page-1)*page_size, page*page_size).all()
+    if columns:
+        return JSONResponse({"count": count, "results": serialize_rows(dorms)})
     return {"count": count, "results": dorms}
 
 @router.get("/{dorm_id}/", response_model=DormPydanticRead, status_code=status.HTTP_200_OK)
 def read_dorm(
     dorm_id: uuid.UUID,
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,active"),
     db: Session = Depends(get_db),
     is_authenticated = Depends(is_authenticated),
     authorization = Security(authorization_token),
@@ -48,11 +61,62 @@ def read_dorm(
     '''
     Get a dorm by id
     '''
-    dorm = db.query(Dorm).filter(Dorm.id==dorm_id).one_or_none()
+    try:
+        columns = parse_columns(fields, DormPydanticRead, Dorm) if fields else None
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    dorm = (db.query(*columns) if columns else db.query(Dorm)).filter(Dorm.id==dorm_id).one_or_none()
     if dorm is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
+    if columns:
+        return JSONResponse(serialize_rows([dorm])[0])
     return dorm
 
+@router.get("/{dorm_id}/tree/", response_model=None, status_code=status.HTTP_200_OK,
+            responses={status.HTTP_200_OK: {"model": DormTreeResponse}})
+def read_dorm_tree(
+    dorm_id: uuid.UUID,
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,rooms.name,rooms.beds.allocated"),
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Get a dorm with all its rooms and their beds
+    '''
+    try:
+        spec = parse_fields(fields, DormTreeResponse) if fields else None
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    cached = dorm_tree_cache.get(str(dorm_id))
+    if cached is None:
+        # taken before loading: a write committing meanwhile must not be cached over
+        generation = dorm_tree_cache.generation(str(dorm_id))
+        # one query per level instead of one per room
+        dorm = db.query(Dorm).filter(Dorm.id==dorm_id)\
+            .options(selectinload(Dorm.rooms).selectinload(Room.beds)).one_or_none()
+        if dorm is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
+        tree = DormTreeResponse.model_validate(dorm, from_attributes=True).model_dump(mode='json')
+        tree['rooms'].sort(key=lambda room: room['room_identifier'])
+        for room in tree['rooms']:
+            room['beds'].sort(key=lambda bed: (bed['number'] is None, bed['number']))
+        etag = hashlib.md5(json.dumps(tree, sort_keys=True).encode()).hexdigest()
+        cached = (etag, tree)
+        dorm_tree_cache.set_if(str(dorm_id), cached, generation)
+
+    etag, tree = cached
+    if spec:
+        etag = f"{etag}-{hashlib.md5(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:8]}"
+    etag = f'"{etag}"'
+    # weakened by the compression middleware when the body was compressed
+    if request.headers.get('If-None-Match', '').removeprefix('W/') == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return JSONResponse(project(tree, spec), headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
 @router.post("/", response_model=DormPydanticRead, status_code=status.HTTP_201_CREATED)
 def create_dorm(
     dorm: DormPydanticWrite,
@@ -88,12 +152,14 @@ def update_dorm(
     if existing_dorm is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
     
-    for var, value in vars(dorm).items():
-        setattr(existing_dorm, var, value) if value else None
+    # only the fields sent, so that active=false can be set and omitted fields are kept
+    for var, value in dorm.model_dump(exclude_unset=True).items():
+        setattr(existing_dorm, var, value) if value is not None else None
     
     try:
         db.commit()
         db.refresh(existing_dorm)
     except Exception as e:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    dorm_tree_cache.delete(str(dorm_id))
     return existing_dorm
\ No newline at end of file
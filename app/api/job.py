@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Security
+from fastapi.security import APIKeyHeader
+from sqlalchemy.orm import Session
+import uuid
+
+from schema import JobCreate, JobResponse
+from models import Job
+from config.db import get_db
+from deps import is_authenticated
+import jobs
+
+router = APIRouter()
+authorization_token = APIKeyHeader(name='Authorization', scheme_name='Authorization')
+x_client_id = APIKeyHeader(name='X-Client-Id', scheme_name='X-Client-Id')
+
+@router.post("/", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def submit_job(
+    job: JobCreate,
+    request: Request,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Queue a bulk operation for the background workers
+    '''
+    try:
+        params = jobs.validate(job.type, job.params)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    user = getattr(request.state, 'user', None) or {}
+    actor = user.get('id') or user.get('email')
+    db_item = Job(type=job.type, params=params, status=Job.STATUSES.QUEUED.value,
+                  actor=str(actor) if actor is not None else None,
+                  client_id=request.headers.get('X-Client-Id'))
+    db.add(db_item)
+    db.commit()
+    db.refresh(db_item)
+    return db_item
+
+@router.get("/{job_id}/", response_model=JobResponse, status_code=status.HTTP_200_OK)
+def read_job(
+    job_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Get the status and progress of a job
+    '''
+    job = db.query(Job).filter(Job.id==job_id).one_or_none()
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Job not found')
+    return job
+
+@router.post("/{job_id}/cancel/", response_model=JobResponse, status_code=status.HTTP_200_OK)
+def cancel_job(
+    job_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Cancel a queued or running job. A running job stops after its current
+    chunk; chunks already processed are not rolled back.
+    '''
+    job = db.query(Job).filter(Job.id==job_id).with_for_update().one_or_none()
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Job not found')
+    if job.status not in (Job.STATUSES.QUEUED.value, Job.STATUSES.RUNNING.value):
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=f'Job already {job.status}')
+    return jobs.cancel(db, job)
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Security
+from fastapi.security import APIKeyHeader
+from sqlalchemy.orm import Session
+
+from schema import ReleaseWave, ReleaseWaveResponse
+from config.db import get_db
+from deps import is_authenticated
+from cache import dorm_tree_cache
+from availability import apply_changes
+from quota import release_wave
+
+router = APIRouter()
+authorization_token = APIKeyHeader(name='Authorization', scheme_name='Authorization')
+x_client_id = APIKeyHeader(name='X-Client-Id', scheme_name='X-Client-Id')
+
+@router.post("/", response_model=ReleaseWaveResponse, status_code=status.HTTP_200_OK)
+def create_release_wave(
+    wave: ReleaseWave,
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Change percent_released of many rooms at once. Either every room of the
+    wave is updated or none is.
+    '''
+    if wave.percent_released is None and not wave.rooms:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='Nothing to release')
+    if wave.percent_released is not None and not (wave.dorm_ids or wave.participant_type):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='percent_released needs dorm_ids or participant_type')
+
+    try:
+        updated = release_wave(db, percent_released=wave.percent_released, dorm_ids=wave.dorm_ids,
+                               participant_type=wave.participant_type, rooms=wave.rooms)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    apply_changes([('release', {'id': room_id, 'percent_released': percent_released})
+                   for room_id, dorm_id, percent_released in updated])
+    for dorm_id in {dorm_id for room_id, dorm_id, percent_released in updated}:
+        dorm_tree_cache.delete(str(dorm_id))
+    return {"updated": len(updated)}
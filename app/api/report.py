@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Security
+from fastapi.security import APIKeyHeader
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from datetime import datetime
+import uuid
+
+from schema import OccupancyReportResponse
+from models import Dorm, DormArchive, Room, RoomArchive
+from config.db import get_db
+from deps import is_authenticated
+from audit import occupancy_report
+
+router = APIRouter()
+authorization_token = APIKeyHeader(name='Authorization', scheme_name='Authorization')
+x_client_id = APIKeyHeader(name='X-Client-Id', scheme_name='X-Client-Id')
+
+@router.get("/occupancy/", response_model=OccupancyReportResponse, status_code=status.HTTP_200_OK)
+def read_occupancy_report(
+    start: datetime,
+    end: Optional[datetime] = Query(None),
+    interval: str = Query('day', pattern='^(hour|day|week|month)$'),
+    dorm_id: Optional[uuid.UUID] = Query(None),
+    room_id: Optional[uuid.UUID] = Query(None),
+    db: Session = Depends(get_db),
+    is_authenticated = Depends(is_authenticated),
+    authorization = Security(authorization_token),
+    x_client_id = Security(x_client_id)):
+    '''
+    Allocations, releases and occupancy over time from the allocation log
+    '''
+    end = end or datetime.utcnow()
+    if end <= start:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='end must be after start')
+
+    room_ids = None
+    if room_id is not None:
+        room_ids = [room_id]
+    elif dorm_id is not None:
+        # reports cover past events too, whose dorms and rooms may be archived
+        dorm = db.query(Dorm.id).filter(Dorm.id==dorm_id).one_or_none()
+        if dorm is None:
+            dorm = db.execute(select(DormArchive.c.id).where(DormArchive.c.id==dorm_id)).one_or_none()
+        if dorm is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
+        room_ids = [id for id, in db.query(Room.id).filter(Room.dorm_id==dorm_id)]
+        room_ids += db.execute(select(RoomArchive.c.id).where(RoomArchive.c.dorm_id==dorm_id)).scalars().all()
+
+    return {"results": occupancy_report(db, start, end, interval=interval, room_ids=room_ids)}
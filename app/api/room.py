@@ -1,14 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Security
+from fastapi.responses import JSONResponse
 from fastapi.security import APIKeyHeader
 from typing import List, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy import func, desc
 import uuid
 
-from schema import RoomCreate, RoomResponse, PaginatedRoomResponse
+from schema import RoomCreate, RoomResponse, PaginatedRoomResponse, parse_columns, serialize_rows
 from models import Dorm, Room
 from config.db import get_db
 from deps import is_authenticated
+from cache import dorm_tree_cache
 
 router = APIRouter()
 authorization_token = APIKeyHeader(name='Authorization', scheme_name='Authorization')
@@ -21,33 +24,43 @@ def list_rooms_for_a_dorm(
     page_size: int = Query(20, gt=0, le=100),
     page: int = Query(1, gt=0),
     active: Optional[bool] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,floor,bed_count"),
     is_authenticated = Depends(is_authenticated),
     authorization = Security(authorization_token),
     x_client_id = Security(x_client_id)):
     '''
     List all the rooms for a dorm
     '''
+    try:
+        columns = parse_columns(fields, RoomResponse, Room) if fields else None
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     # check if dorm exists
     dorm = db.query(Dorm).filter(Dorm.id==dorm_id).one_or_none()
     if dorm is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
 
     # get all rooms for this dorm
-    rooms = db.query(Room).filter(Room.dorm_id==dorm_id).order_by(desc(Room.created_at))
-    count = rooms.count()
+    rooms = (db.query(*columns) if columns else db.query(Room))\
+        .filter(Room.dorm_id==dorm_id).order_by(desc(Room.created_at))
     
     # apply filters if any
     if active is not None:
         rooms = rooms.filter(Room.active == active)
+    count = rooms.count()
     
     # apply pagination
     rooms = rooms.slice((page-1)*page_size, page*page_size).all()
+    if columns:
+        return JSONResponse({"count": count, "results": serialize_rows(rooms)})
     return {"count": count, "results": rooms}
 
 @router.get("/{room_id}/", response_model=RoomResponse, status_code=status.HTTP_200_OK)
 def read_room(
     dorm_id: str,
     room_id: str,
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,floor,bed_count"),
     db: Session = Depends(get_db),
     is_authenticated = Depends(is_authenticated),
     authorization = Security(authorization_token),
@@ -55,18 +68,26 @@ def read_room(
     '''
     Get a room by id
     '''
+    try:
+        columns = parse_columns(fields, RoomResponse, Room) if fields else None
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     # check if dorm exists
     dorm = db.query(Dorm).filter(Dorm.id==dorm_id).one_or_none()
     if dorm is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
 
     # get room
-    room = db.query(Room).filter(Room.id==room_id).one_or_none()
+    room = (db.query(*columns) if columns else db.query(Room)).filter(Room.id==room_id).one_or_none()
     if room is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Room not found')
+    if columns:
+        return JSONResponse(serialize_rows([room])[0])
     return room
 
-@router.post("/", response_model=RoomResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/", response_model=RoomResponse, status_code=status.HTTP_201_CREATED,
+             responses={status.HTTP_409_CONFLICT: {"description": "Room already exists"}})
 def create_room(
     dorm_id: uuid.UUID,
     room: RoomCreate,
@@ -81,24 +102,24 @@ def create_room(
     dorm = db.query(Dorm).filter(Dorm.id==dorm_id).one_or_none()
     if dorm is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Dorm not found')
-    
-    # check if room already exists
-    existing_room = db.query(Room).filter(Room.name==room.name,
-                                          Room.dorm_id==dorm_id).one_or_none()
-    if existing_room is not None:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='Room already exists')
 
-    # create room
+    # create room, the unique index on (dorm_id, name) rejects duplicates,
+    # also between concurrent requests
     try:
         db_item = Room(**room.model_dump(), dorm_id=dorm_id)
         db.add(db_item)
         db.commit()
-        db.refresh(db_item)
-    except Exception as e:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str('Room already exists'))
+    except IntegrityError as e:
+        db.rollback()
+        if e.orig.diag.constraint_name == 'ix_room_dorm_id_name':
+            raise HTTPException(status.HTTP_409_CONFLICT, detail='Room already exists')
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e.orig))
+    db.refresh(db_item)
+    dorm_tree_cache.delete(str(dorm_id))
     return db_item
 
-@router.patch("/{room_id}/", response_model=RoomResponse, status_code=status.HTTP_200_OK)
+@router.patch("/{room_id}/", response_model=RoomResponse, status_code=status.HTTP_200_OK,
+              responses={status.HTTP_409_CONFLICT: {"description": "Room already exists"}})
 def update_room(
     dorm_id: uuid.UUID,
     room_id: uuid.UUID,
@@ -120,19 +141,20 @@ def update_room(
     if existing_room is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Room not found')
     
-    # check if room already exists
-    dup_room = db.query(Room).filter(Room.name==room.name,
-                                          Room.dorm_id==dorm_id).one_or_none()
-    if dup_room is not None and dup_room.id != room_id:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='Room already exists')
-    
     # update room
-    for var, value in vars(room).items():
-        setattr(existing_room, var, value) if value else None
+    # only the fields sent, so that active=false can be set and omitted fields are kept
+    for var, value in room.model_dump(exclude_unset=True).items():
+        setattr(existing_room, var, value) if value is not None else None
     
     try:
         db.commit()
         db.refresh(existing_room)
+    except IntegrityError as e:
+        db.rollback()
+        if e.orig.diag.constraint_name == 'ix_room_dorm_id_name':
+            raise HTTPException(status.HTTP_409_CONFLICT, detail='Room already exists')
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e.orig))
     except Exception as e:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    dorm_tree_cache.delete(str(dorm_id))
     return existing_room
\ No newline at end of file
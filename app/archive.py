@@ -0,0 +1,113 @@
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import and_, delete, exists, func, insert, literal, or_, select
+
+from models import Bed, BedArchive, Dorm, DormArchive, Room, RoomArchive
+
+load_dotenv()
+
+# inactive rows untouched for this long are moved to the archive tables
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+
+# children first, a parent is only moved once none of its children are left
+LEVELS = ('bed', 'room', 'dorm')
+
+
+class ArchiveConflict(Exception):
+    pass
+
+
+def cutoff(older_than_days=None):
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    return datetime.utcnow() - timedelta(days=days)
+
+def _dorms(before):
+    return select(Dorm.id).where(Dorm.active==False, Dorm.updated_at < before)
+
+def _rooms(before):
+    return select(Room.id).where(or_(and_(Room.active==False, Room.updated_at < before),
+                                     Room.dorm_id.in_(_dorms(before))))
+
+def _beds(before):
+    return select(Bed.id).where(or_(and_(Bed.active==False, Bed.updated_at < before),
+                                    Bed.room_id.in_(_rooms(before))))
+
+def _archivable(level, before):
+    '''
+    Ids of the rows of `level` that can be moved now: inactive and older than
+    `before`, or under such a parent
+    '''
+    if level == 'bed':
+        return _beds(before)
+    if level == 'room':
+        return _rooms(before).where(~exists().where(Bed.room_id==Room.id))
+    return _dorms(before).where(~exists().where(Room.dorm_id==Dorm.id))
+
+def count(db, before):
+    return sum(db.execute(select(func.count()).select_from(ids.subquery())).scalar()
+               for ids in (_beds(before), _rooms(before), _dorms(before)))
+
+def _move(db, source, target, where, values=None):
+    # one statement, the rows are deleted and inserted together; `values` replace copied columns
+    values = values or {}
+    columns = [column.name for column in source.c if column.name in target.c]
+    moved = delete(source).where(where).returning(*[source.c[name] for name in columns]).cte('moved')
+    rows = select(*[literal(values[name], type_=target.c[name].type) if name in values else moved.c[name]
+                    for name in columns])
+    return db.execute(insert(target).from_select(columns, rows)).rowcount
+
+def _tables(level):
+    return {'bed': (Bed.__table__, BedArchive),
+            'room': (Room.__table__, RoomArchive),
+            'dorm': (Dorm.__table__, DormArchive)}[level]
+
+def archive_chunk(db, level, before, chunk_size):
+    '''
+    Move up to `chunk_size` archivable rows of `level` to its archive table.
+    Returns the number of rows moved.
+    '''
+    table, archive = _tables(level)
+    # no order needed, moved rows no longer match
+    ids = _archivable(level, before).limit(chunk_size)
+    return _move(db, table, archive, table.c.id.in_(ids.scalar_subquery()))
+
+
+def restore(db, level, id):
+    '''
+    Move an archived dorm, room or bed back to the live tables together with
+    everything archived under it. Raises LookupError if it is not archived
+    and ArchiveConflict if its parent is still archived. Returns the id of
+    the dorm and the number of rows restored per level.
+    '''
+    archive = _tables(level)[1]
+    row = db.execute(select(archive).where(archive.c.id==id).with_for_update()).one_or_none()
+    if row is None:
+        raise LookupError(f'{level.capitalize()} is not archived')
+
+    if level == 'bed':
+        dorm_id = db.execute(select(Room.dorm_id).where(Room.id==row.room_id)).scalar()
+        if dorm_id is None:
+            raise ArchiveConflict('Restore the room of this bed first')
+    elif level == 'room':
+        dorm_id = row.dorm_id
+        if db.execute(select(Dorm.id).where(Dorm.id==dorm_id)).scalar() is None:
+            raise ArchiveConflict('Restore the dorm of this room first')
+    else:
+        dorm_id = row.id
+
+    # restored rows count as just changed, otherwise the next archive run moves them straight back
+    touched = {'updated_at': datetime.utcnow()}
+    # parents first for the foreign keys
+    restored = {}
+    if level == 'dorm':
+        restored['dorm'] = _move(db, DormArchive, Dorm.__table__, DormArchive.c.id==id, touched)
+        restored['room'] = _move(db, RoomArchive, Room.__table__, RoomArchive.c.dorm_id==id, touched)
+        restored['bed'] = _move(db, BedArchive, Bed.__table__,
+                                BedArchive.c.room_id.in_(select(Room.id).where(Room.dorm_id==id)), touched)
+    elif level == 'room':
+        restored['room'] = _move(db, RoomArchive, Room.__table__, RoomArchive.c.id==id, touched)
+        restored['bed'] = _move(db, BedArchive, Bed.__table__, BedArchive.c.room_id==id, touched)
+    else:
+        restored['bed'] = _move(db, BedArchive, Bed.__table__, BedArchive.c.id==id, touched)
+    return dorm_id, restored
@@ -0,0 +1,160 @@
+import logging
+from datetime import date, datetime
+from sqlalchemy import case, event, func, insert, inspect, text
+
+from config.db import engine, SessionLocal
+from models import AllocationEvent, Bed, BedArchive
+
+logger = logging.getLogger(__name__)
+
+# state changes that are logged
+TRACKED = ('allocated', 'blocked')
+
+
+def value_change(state, attribute):
+    '''
+    (before, after) of an attribute in the current flush
+    '''
+    history = state.attrs[attribute].history
+    before = history.deleted[0] if history.deleted else history.unchanged[0] if history.unchanged else None
+    after = history.added[0] if history.added else before
+    return before, after
+
+def _request_context(session):
+    request = session.info.get('request')
+    if request is None:
+        return session.info.get('actor'), session.info.get('client_id')
+    user = getattr(request.state, 'user', None) or {}
+    actor = user.get('id') or user.get('email')
+    return (str(actor) if actor is not None else None), request.headers.get('X-Client-Id')
+
+def _log_bed_changes(session, flush_context):
+    '''
+    Writes one row per changed bed in a single multi-row insert, on the
+    flush's connection so that it commits or rolls back with the change
+    '''
+    events = []
+    for bed in list(session.new) + list(session.dirty):
+        if not isinstance(bed, Bed):
+            continue
+        state = inspect(bed)
+        changes = {}
+        for attribute in TRACKED:
+            before, after = value_change(state, attribute)
+            if bed in session.new:
+                before = None
+            changes[f'from_{attribute}'] = before
+            changes[f'to_{attribute}'] = after
+        if all(changes[f'from_{a}'] == changes[f'to_{a}'] for a in TRACKED):
+            continue
+        events.append(dict(changes, bed_id=bed.id, room_id=bed.room_id))
+    if not events:
+        return
+    actor, client_id = _request_context(session)
+    now = datetime.utcnow()
+    for row in events:
+        row.update(created_at=now, actor=actor, client_id=client_id)
+    session.connection().execute(insert(AllocationEvent), events)
+
+event.listen(SessionLocal, 'after_flush', _log_bed_changes)
+
+# load the previous value when an expired bed is changed, otherwise the
+# "from" state would be unknown
+for attribute in TRACKED:
+    event.listen(getattr(Bed, attribute), 'set', lambda *args: None, active_history=True)
+
+
+def bed_history(db, bed_id, offset=0, limit=20):
+    return db.query(AllocationEvent).filter(AllocationEvent.bed_id==bed_id)\
+        .order_by(AllocationEvent.created_at.desc(), AllocationEvent.id.desc())\
+        .offset(offset).limit(limit).all()
+
+def occupancy_report(db, start, end, interval='day', room_ids=None):
+    '''
+    Allocations, releases and resulting occupancy per interval between start
+    and end. Only the partitions of the requested range are scanned; the
+    occupancy level is anchored on the current allocated count minus the
+    changes logged since `start`. Archived beds count as well, their
+    allocations are logged like the others and archiving logs nothing.
+    '''
+    delta = case((AllocationEvent.to_allocated.is_(True) & AllocationEvent.from_allocated.isnot(True), 1),
+                 (AllocationEvent.to_allocated.isnot(True) & AllocationEvent.from_allocated.is_(True), -1),
+                 else_=0)
+    bucket = func.date_trunc(interval, AllocationEvent.created_at).label('bucket')
+    events = db.query(AllocationEvent).filter(AllocationEvent.created_at >= start)
+    current = db.query(func.count(Bed.id)).filter(Bed.allocated==True)
+    archived = db.query(func.count()).select_from(BedArchive).filter(BedArchive.c.allocated==True)
+    if room_ids is not None:
+        events = events.filter(AllocationEvent.room_id.in_(room_ids))
+        current = current.filter(Bed.room_id.in_(room_ids))
+        archived = archived.filter(BedArchive.c.room_id.in_(room_ids))
+
+    since_start = events.with_entities(func.coalesce(func.sum(delta), 0)).scalar()
+    occupancy = current.scalar() + archived.scalar() - since_start
+
+    rows = events.filter(AllocationEvent.created_at < end)\
+        .with_entities(bucket,
+                       func.count().filter(delta == 1).label('allocated'),
+                       func.count().filter(delta == -1).label('released'))\
+        .group_by(bucket).order_by(bucket).all()
+    report = []
+    for row in rows:
+        occupancy += row.allocated - row.released
+        report.append({"bucket": row.bucket, "allocated": row.allocated,
+                       "released": row.released, "occupancy": occupancy})
+    return report
+
+
+def _month(day, offset=0):
+    month = day.month - 1 + offset
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def create_partitions(conn, start=None, months=3):
+    '''
+    Create the monthly partitions of allocation_event from `start` (this
+    month by default) for the given number of months. Safe to call repeatedly.
+    '''
+    start = _month(start or date.today())
+    for i in range(months):
+        lower, upper = _month(start, i), _month(start, i + 1)
+        name = f"allocation_event_{lower:%Y_%m}"
+        bounds = f"FOR VALUES FROM ('{lower:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+        if conn.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is not None:
+            continue
+        month = {'lower': lower, 'upper': upper}
+        stray = conn.execute(text("SELECT count(*) FROM allocation_event_default "
+                                  "WHERE created_at >= :lower AND created_at < :upper"), month).scalar()
+        if not stray:
+            conn.execute(text(f"CREATE TABLE {name} PARTITION OF allocation_event {bounds}"))
+            continue
+        # rows of the month in the default partition make CREATE ... PARTITION OF fail,
+        # they are moved to the new table before it is attached
+        conn.execute(text(f"CREATE TABLE {name} (LIKE allocation_event INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        conn.execute(text(f"WITH moved AS (DELETE FROM allocation_event_default "
+                          f"WHERE created_at >= :lower AND created_at < :upper RETURNING *) "
+                          f"INSERT INTO {name} SELECT * FROM moved"), month)
+        conn.execute(text(f"ALTER TABLE allocation_event ATTACH PARTITION {name} {bounds}"))
+        logger.warning("Moved %d allocation events from allocation_event_default to %s", stray, name)
+
+def ensure_partitions(months=3):
+    '''
+    Keep the next months partitioned ahead of time, run at startup and
+    periodically by the worker. Rows that still miss a partition go to
+    allocation_event_default, which is reported as an error. Returns the
+    number of rows in it.
+    '''
+    try:
+        with engine.begin() as conn:
+            create_partitions(conn, months=months)
+    except Exception as e:
+        logger.error("Could not create allocation_event partitions: %s", e)
+    try:
+        with engine.connect() as conn:
+            stray = conn.execute(text("SELECT count(*), min(created_at) FROM allocation_event_default")).one()
+    except Exception as e:
+        logger.error("Could not check allocation_event_default: %s", e)
+        return None
+    if stray[0]:
+        logger.error("allocation_event_default holds %d allocation events since %s, "
+                     "create the partitions of their months", stray[0], stray[1])
+    return stray[0]
@@ -0,0 +1,483 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from array import array
+from enum import Enum
+from dotenv import load_dotenv
+from sqlalchemy import event, select
+
+from config.db import engine, SessionLocal
+from models import Dorm, Room, Bed
+from quota import released_beds
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Bits per block. Queries AND whole blocks and stop at the first blocks that
+# have enough candidates, so a lookup only touches the blocks it needs.
+BLOCK_SIZE = 4096
+
+# filter name -> column for the attributes kept in the index
+ROOM_ATTRIBUTES = {
+    'ac_available': Room.ac_available,
+    'floor': Room.floor,
+    'room_close_to_dorm_entrance': Room.close_to_dorm_entrance,
+    'room_close_to_bath': Room.close_to_bath,
+    'bed_type': Room.bed_type,
+    'participant_type': Room.participant_type,
+}
+BED_ATTRIBUTES = {
+    'level': Bed.level,
+    'close_to_dorm_entrance': Bed.close_to_dorm_entrance,
+    'close_to_bath': Bed.close_to_bath,
+}
+
+# per-slot bed state flags
+ACTIVE = 1
+BLOCKED = 2
+ALLOCATED = 4
+
+
+def _add_to_ranges(ranges, slot):
+    if ranges and ranges[-1][1] == slot:
+        ranges[-1][1] += 1
+    else:
+        ranges.append([slot, slot + 1])
+
+
+def _key(name, value):
+    # enum members and their values must land on the same bitset
+    return (name, value.value if isinstance(value, Enum) else value)
+
+
+def _slot_flags(active, blocked, allocated):
+    return (ACTIVE if active is not False else 0) | (BLOCKED if blocked else 0) \
+        | (ALLOCATED if allocated else 0)
+
+
+class AvailabilityIndex:
+    '''
+    Per-worker index of free beds. Every bed gets a slot number and every
+    attribute value a bitset over the slots, so a lookup is a handful of
+    integer ANDs. Slots are laid out by dorm and room at load time which
+    keeps dorm and room filters to a few contiguous ranges.
+
+    The index only proposes candidates, the database decides the claim.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.size = 0
+        self.ids = bytearray()              # 16 bytes per slot
+        self.slot_room = array('I')         # room number per slot
+        self.slot_flags = bytearray()       # ACTIVE | BLOCKED | ALLOCATED per slot
+        self.room_ids = []
+        self.room_index = {}
+        self.room_dorm = array('I')
+        self.room_active = []
+        self.room_attributes = []          # ROOM_ATTRIBUTES values per room
+        self.room_percent = []              # percent_released per room
+        self.room_beds = array('i')         # active beds per room
+        self.room_allocated = array('i')    # allocated active beds per room
+        self.room_slots = []
+        self.dorm_ids = []
+        self.dorm_index = {}
+        self.dorm_active = []
+        self.dorm_slots = []
+        self.bits = {}                      # (filter, value) -> list of block ints
+        self.free = []
+
+    # building
+
+    @classmethod
+    def load(cls, bind=engine, chunk_size=10000):
+        '''
+        Build the index from the database in a single streamed query
+        '''
+        columns = [Bed.id, Bed.room_id, Bed.active, Bed.blocked, Bed.allocated,
+                   Room.dorm_id, Room.active, Dorm.active, Room.percent_released] \
+            + list(ROOM_ATTRIBUTES.values()) + list(BED_ATTRIBUTES.values())
+        query = select(*columns).join(Room, Bed.room_id == Room.id).join(Dorm, Room.dorm_id == Dorm.id)\
+            .order_by(Room.dorm_id, Bed.room_id, Bed.number)
+        with bind.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+            return cls.from_rows(result, chunk_size)
+
+    @classmethod
+    def from_rows(cls, rows, chunk_size=10000):
+        '''
+        Build the index from (bed id, room id, bed active, blocked, allocated,
+        dorm id, room active, dorm active, percent released, *room attributes,
+        *bed attributes) rows, grouped by dorm and room
+        '''
+        index = cls()
+        buffers = {}
+        free = bytearray()
+        capacity = 0
+        room_buffers = {}
+
+        def buffer_for(name, value):
+            if (name, value) not in buffers:
+                buffers[(name, value)] = bytearray(capacity)
+            return buffers[(name, value)]
+
+        for row in rows:
+            bed_id, room_id, active, blocked, allocated, dorm_id, room_active, dorm_active, percent = row[:9]
+            room = index.room_index.get(room_id)
+            if room is None:
+                attributes = tuple(row[9:9 + len(ROOM_ATTRIBUTES)])
+                room = index._add_room(room_id, dorm_id, room_active, attributes, percent, dorm_active)
+                # room attributes are the same for all its beds
+                room_buffers[room] = [buffer_for(name, value) for name, value in zip(ROOM_ATTRIBUTES, attributes)]
+            slot = index._add_slot(bed_id, room, _slot_flags(active, blocked, allocated))
+            index._count(room, 0, index.slot_flags[slot])
+            byte, bit = slot >> 3, 1 << (slot & 7)
+            if byte >= capacity:
+                capacity += chunk_size
+                for buffer in [free] + list(buffers.values()):
+                    buffer.extend(bytes(capacity - len(buffer)))
+            if index._is_open(slot):
+                free[byte] |= bit
+            for buffer in room_buffers[room]:
+                buffer[byte] |= bit
+            for name, value in zip(BED_ATTRIBUTES, row[9 + len(ROOM_ATTRIBUTES):]):
+                buffer_for(name, value)[byte] |= bit
+        index.free = index._to_blocks(free)
+        index.bits = {_key(*key): index._to_blocks(buffer) for key, buffer in buffers.items()}
+        # rooms whose released quota is used up show no free beds
+        for room in range(len(index.room_ids)):
+            if index._remaining(room) <= 0:
+                index._refresh_room(room)
+        return index
+
+    def _to_blocks(self, buffer):
+        step = BLOCK_SIZE // 8
+        blocks = [int.from_bytes(buffer[i:i + step], 'little') for i in range(0, len(buffer), step)]
+        blocks.extend([0] * (self._block_count() - len(blocks)))
+        return blocks[:self._block_count()]
+
+    def _block_count(self):
+        return (self.size + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+    def _add_dorm(self, dorm_id, active):
+        self.dorm_index[dorm_id] = len(self.dorm_ids)
+        self.dorm_ids.append(dorm_id)
+        self.dorm_active.append(active is not False)
+        self.dorm_slots.append([])
+        return self.dorm_index[dorm_id]
+
+    def _add_room(self, room_id, dorm_id, active, attributes, percent_released, dorm_active=True):
+        dorm = self.dorm_index.get(dorm_id)
+        if dorm is None:
+            dorm = self._add_dorm(dorm_id, dorm_active)
+        self.room_index[room_id] = len(self.room_ids)
+        self.room_ids.append(room_id)
+        self.room_dorm.append(dorm)
+        self.room_active.append(active is not False)
+        self.room_attributes.append(attributes)
+        self.room_percent.append(percent_released)
+        self.room_beds.append(0)
+        self.room_allocated.append(0)
+        self.room_slots.append([])
+        return self.room_index[room_id]
+
+    def _add_slot(self, bed_id, room, flags):
+        slot = self.size
+        self.size += 1
+        self.ids += bed_id.bytes
+        self.slot_room.append(room)
+        self.slot_flags.append(flags)
+        _add_to_ranges(self.room_slots[room], slot)
+        _add_to_ranges(self.dorm_slots[self.room_dorm[room]], slot)
+        if self._block_count() > len(self.free):
+            self.free.append(0)
+            for blocks in self.bits.values():
+                blocks.append(0)
+        return slot
+
+    def _is_open(self, slot):
+        room = self.slot_room[slot]
+        return self.slot_flags[slot] & (ACTIVE | BLOCKED | ALLOCATED) == ACTIVE \
+            and self.room_active[room] and self.dorm_active[self.room_dorm[room]]
+
+    def _is_free(self, slot):
+        return self._is_open(slot) and self._remaining(self.slot_room[slot]) > 0
+
+    def _remaining(self, room):
+        return released_beds(self.room_beds[room], self.room_percent[room]) - self.room_allocated[room]
+
+    def _count(self, room, old_flags, new_flags):
+        # same rules as the room.bed_count and room.allocated_count columns
+        self.room_beds[room] += bool(new_flags & ACTIVE) - bool(old_flags & ACTIVE)
+        self.room_allocated[room] += (new_flags & (ACTIVE | ALLOCATED) == ACTIVE | ALLOCATED) \
+            - (old_flags & (ACTIVE | ALLOCATED) == ACTIVE | ALLOCATED)
+
+    def _refresh_room(self, room):
+        for slot in self._room_slots(room):
+            self._set_bit(self.free, slot, self._is_free(slot))
+
+    # updates
+
+    def _set_bit(self, blocks, slot, on):
+        block, bit = divmod(slot, BLOCK_SIZE)
+        if on:
+            blocks[block] |= 1 << bit
+        elif blocks[block] >> bit & 1:
+            blocks[block] ^= 1 << bit
+
+    def _set_attributes(self, slot, names, values):
+        for name in names:
+            for key, blocks in self.bits.items():
+                if key[0] == name:
+                    self._set_bit(blocks, slot, False)
+            key = _key(name, values.get(name))
+            if key not in self.bits:
+                self.bits[key] = [0] * self._block_count()
+            self._set_bit(self.bits[key], slot, True)
+
+    def _find_slot(self, bed_id, room):
+        needle = bed_id.bytes
+        for start, end in self.room_slots[room]:
+            position = self.ids.find(needle, start * 16, end * 16)
+            while position != -1 and position % 16:
+                position = self.ids.find(needle, position + 1, end * 16)
+            if position != -1:
+                return position // 16
+        return None
+
+    def _room_slots(self, room):
+        for start, end in self.room_slots[room]:
+            yield from range(start, end)
+
+    def update_dorm(self, dorm):
+        with self.lock:
+            index = self.dorm_index.get(dorm['id'])
+            if index is None:
+                self._add_dorm(dorm['id'], dorm['active'])
+                return
+            self.dorm_active[index] = dorm['active'] is not False
+            for start, end in self.dorm_slots[index]:
+                for slot in range(start, end):
+                    self._set_bit(self.free, slot, self._is_free(slot))
+
+    def update_room(self, room):
+        with self.lock:
+            index = self.room_index.get(room['id'])
+            if index is None:
+                self._add_room(room['id'], room['dorm_id'], room['active'],
+                               tuple(room[name] for name in ROOM_ATTRIBUTES), room['percent_released'])
+                return
+            self.room_active[index] = room['active'] is not False
+            self.room_attributes[index] = tuple(room[name] for name in ROOM_ATTRIBUTES)
+            self.room_percent[index] = room['percent_released']
+            for slot in self._room_slots(index):
+                self._set_attributes(slot, ROOM_ATTRIBUTES, room)
+            self._refresh_room(index)
+
+    def update_release(self, room_id, percent_released):
+        with self.lock:
+            index = self.room_index.get(room_id)
+            if index is not None:
+                self.room_percent[index] = percent_released
+                self._refresh_room(index)
+
+    def update_bed(self, bed):
+        '''
+        Apply a committed bed. Beds of rooms this worker has not seen yet are
+        left to the next reload.
+        '''
+        with self.lock:
+            index = self.room_index.get(bed['room_id'])
+            if index is None:
+                return
+            slot = self._find_slot(bed['id'], index)
+            if slot is None:
+                slot = self._add_slot(bed['id'], index, 0)
+                self._set_attributes(slot, ROOM_ATTRIBUTES,
+                                     dict(zip(ROOM_ATTRIBUTES, self.room_attributes[index])))
+            flags = _slot_flags(bed['active'], bed['blocked'], bed['allocated'])
+            released = self._remaining(index) > 0
+            self._count(index, self.slot_flags[slot], flags)
+            self.slot_flags[slot] = flags
+            self._set_attributes(slot, BED_ATTRIBUTES, bed)
+            if released != (self._remaining(index) > 0):
+                self._refresh_room(index)
+            else:
+                self._set_bit(self.free, slot, self._is_free(slot))
+
+    # lookups
+
+    def find(self, dorm_id=None, room_id=None, limit=10, **filters):
+        '''
+        Returns up to `limit` (bed_id, room_id, dorm_id) tuples of free beds
+        matching all `filters`, in slot order. No room contributes more beds
+        than its released quota has left.
+        '''
+        masks = []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in ROOM_ATTRIBUTES and name not in BED_ATTRIBUTES:
+                raise ValueError(f"Unknown filter '{name}'")
+            blocks = self.bits.get(_key(name, value))
+            if blocks is None:
+                return []
+            masks.append(blocks)
+
+        if room_id is not None:
+            room = self.room_index.get(room_id)
+            if room is None or (dorm_id is not None and self.dorm_ids[self.room_dorm[room]] != dorm_id):
+                return []
+            ranges = self.room_slots[room]
+        elif dorm_id is not None:
+            dorm = self.dorm_index.get(dorm_id)
+            if dorm is None:
+                return []
+            ranges = self.dorm_slots[dorm]
+        else:
+            ranges = [[0, self.size]]
+
+        slots = []
+        taken = {}
+        free = self.free
+        for start, end in ranges:
+            for block in range(start // BLOCK_SIZE, (end - 1) // BLOCK_SIZE + 1 if end else 0):
+                candidates = free[block]
+                for blocks in masks:
+                    if not candidates:
+                        break
+                    candidates &= blocks[block]
+                if not candidates:
+                    continue
+                # trim the block to the range
+                base = block * BLOCK_SIZE
+                if start > base:
+                    candidates &= ~((1 << (start - base)) - 1)
+                if end < base + BLOCK_SIZE:
+                    candidates &= (1 << (end - base)) - 1
+                while candidates:
+                    lowest = candidates & -candidates
+                    candidates ^= lowest
+                    slot = base + lowest.bit_length() - 1
+                    room = self.slot_room[slot]
+                    if taken.get(room, 0) >= self._remaining(room):
+                        continue
+                    taken[room] = taken.get(room, 0) + 1
+                    slots.append(slot)
+                    if len(slots) == limit:
+                        return self._describe(slots)
+        return self._describe(slots)
+
+    def _describe(self, slots):
+        results = []
+        for slot in slots:
+            room = self.slot_room[slot]
+            results.append((uuid.UUID(bytes=bytes(self.ids[slot * 16:slot * 16 + 16])),
+                            self.room_ids[room], self.dorm_ids[self.room_dorm[room]]))
+        return results
+
+
+def _snapshot(obj, columns):
+    return {column: getattr(obj, column) for column in columns}
+
+def _as_uuid(value):
+    return value if isinstance(value, uuid.UUID) or value is None else uuid.UUID(str(value))
+
+def _capture_changes(session, flush_context):
+    # values are read while the objects are still loaded, they are applied on commit
+    changes = session.info.setdefault('availability_changes', [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Dorm):
+            changes.append(('dorm', {'id': obj.id, 'active': obj.active}))
+        elif isinstance(obj, Room):
+            room = {name: getattr(obj, column.key) for name, column in ROOM_ATTRIBUTES.items()}
+            room.update(id=obj.id, dorm_id=_as_uuid(obj.dorm_id), active=obj.active,
+                        percent_released=obj.percent_released)
+            changes.append(('room', room))
+        elif isinstance(obj, Bed):
+            bed = _snapshot(obj, ['id', 'active', 'blocked', 'allocated'] + list(BED_ATTRIBUTES))
+            bed['room_id'] = _as_uuid(obj.room_id)
+            changes.append(('bed', bed))
+
+def _apply(index, changes):
+    # parents first so that beds of a new room find it
+    for kind, values in sorted(changes, key=lambda change: ('dorm', 'room', 'release', 'bed').index(change[0])):
+        if kind == 'dorm':
+            index.update_dorm(values)
+        elif kind == 'room':
+            index.update_room(values)
+        elif kind == 'release':
+            index.update_release(values['id'], values['percent_released'])
+        else:
+            index.update_bed(values)
+
+def apply_changes(changes):
+    '''
+    Apply committed changes to the index, and keep them for the index
+    being reloaded so that they are not lost when it replaces this one
+    '''
+    if not changes:
+        return
+    with reload_lock:
+        index = availability_index
+        if reload_changes is not None:
+            reload_changes.extend(changes)
+    if index is not None:
+        _apply(index, changes)
+
+def _apply_changes(session):
+    apply_changes(session.info.pop('availability_changes', []))
+
+def _discard_changes(session):
+    session.info.pop('availability_changes', None)
+
+
+availability_index = None
+# changes committed while the index is being reloaded, None otherwise
+reload_changes = None
+reload_lock = threading.Lock()
+
+def get_index():
+    return availability_index
+
+def load_index():
+    '''
+    Load the index and keep it current from committed writes of this worker.
+    Writes from other workers are picked up by the periodic reload.
+    '''
+    global availability_index, reload_changes
+    if not event.contains(SessionLocal, 'after_flush', _capture_changes):
+        event.listen(SessionLocal, 'after_flush', _capture_changes)
+        event.listen(SessionLocal, 'after_commit', _apply_changes)
+        event.listen(SessionLocal, 'after_soft_rollback', lambda session, transaction: _discard_changes(session))
+    started = time.perf_counter()
+    with reload_lock:
+        reload_changes = []
+    try:
+        index = AvailabilityIndex.load()
+        with reload_lock:
+            # the loaded rows may already include some of them, applying a change again is harmless
+            _apply(index, reload_changes)
+            replayed = len(reload_changes)
+            availability_index = index
+    finally:
+        with reload_lock:
+            reload_changes = None
+    logger.info("Availability index loaded %d beds in %.2fs, %d changes replayed",
+                index.size, time.perf_counter() - started, replayed)
+
+def start_index():
+    if os.environ.get("AVAILABILITY_INDEX_ENABLED", "false").lower() != "true":
+        return
+    load_index()
+    interval = float(os.environ.get("AVAILABILITY_INDEX_REFRESH", 300))
+    if interval > 0:
+        def refresh():
+            while True:
+                time.sleep(interval)
+                try:
+                    load_index()
+                except Exception as e:
+                    logger.exception("Availability index reload failed: %s", e)
+        threading.Thread(target=refresh, name="availability-index", daemon=True).start()
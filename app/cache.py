@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class TTLCache:
+    '''
+    Small per-worker cache. Entries expire after `ttl` seconds so that writes
+    made through other workers are picked up eventually; writes through this
+    worker invalidate the affected keys right away. Dorm trees are also
+    invalidated by the job worker's writes, see invalidation.py.
+
+    A value loaded from the database can be stale by the time it is stored,
+    if a write invalidated its key in between. Readers take `generation(key)`
+    before loading and store with `set_if`, which drops the value if the key
+    was invalidated since.
+    '''
+    def __init__(self, ttl, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.data = {}
+        # bumped by delete per key and by clear for all keys
+        self.generations = {}
+        self.cleared = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.data[key]
+                return None
+            return value
+
+    def generation(self, key):
+        with self.lock:
+            return self.cleared, self.generations.get(key, 0)
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self._store(key, value)
+
+    def set_if(self, key, value, generation):
+        '''
+        Store `value` unless `key` was invalidated after `generation` was taken
+        '''
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            if (self.cleared, self.generations.get(key, 0)) == generation:
+                self._store(key, value)
+
+    def _store(self, key, value):
+        if key not in self.data and len(self.data) >= self.max_size:
+            # evict the entry closest to expiry
+            del self.data[min(self.data, key=lambda k: self.data[k][0])]
+        self.data[key] = (time.monotonic() + self.ttl, value)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.generations[key] = self.generations.get(key, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            # the per key generations are covered by this one
+            self.generations.clear()
+            self.cleared += 1
+
+
+# Serialized dorm -> room -> bed trees keyed by dorm id
+dorm_tree_cache = TTLCache(ttl=float(os.environ.get("DORM_TREE_CACHE_TTL", 30)))
@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 import os
+from fastapi import Request
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
@@ -28,8 +29,10 @@ def check_db_connection():
         print(f'Error: {e}')
         return False
     
-def get_db():
+def get_db(request: Request = None):
     db = SessionLocal()
+    # lets session hooks see who is making the change
+    db.info['request'] = request
     try:
         yield db
     finally:
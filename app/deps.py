@@ -1,24 +1,230 @@
-import requests
+import asyncio
+import hashlib
+import logging
+import math
+import time
+import httpx
 from fastapi import Request, HTTPException, status
 
 import os
 from dotenv import load_dotenv
+from cache import TTLCache
 load_dotenv()
+logger = logging.getLogger(__name__)
 
-def is_authenticated(request: Request):
+AUTH_CONNECT_TIMEOUT = float(os.environ.get("AUTH_CONNECT_TIMEOUT", 1))
+AUTH_READ_TIMEOUT = float(os.environ.get("AUTH_READ_TIMEOUT", 3))
+# waiting for a free connection of the pool, i.e. on our side
+AUTH_POOL_TIMEOUT = float(os.environ.get("AUTH_POOL_TIMEOUT", 5))
+AUTH_MAX_CONNECTIONS = int(os.environ.get("AUTH_MAX_CONNECTIONS", 100))
+# consecutive upstream failures that open the breaker, and for how long it stays open
+AUTH_BREAKER_FAILURES = int(os.environ.get("AUTH_BREAKER_FAILURES", 5))
+AUTH_BREAKER_RESET = float(os.environ.get("AUTH_BREAKER_RESET", 30))
+
+
+class CircuitBreaker:
+    '''
+    Opens after `failures` consecutive failures and rejects calls for
+    `reset_after` seconds, then lets a single trial call through: its
+    success closes the breaker, its failure opens it again.
+    '''
+    def __init__(self, failures, reset_after):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.count = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_after or self.trial:
+            return False
+        self.trial = True
+        return True
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.reset_after - (time.monotonic() - self.opened_at)))
+
+    def success(self):
+        self.count = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.count += 1
+        if self.trial or self.count >= self.failures:
+            self.opened_at = time.monotonic()
+        self.trial = False
+
+    def skip(self):
+        # the call was not made, the next one is the trial
+        self.trial = False
+
+
+class JWKSVerifier:
+    '''
+    Verifies signed tokens locally against the keys published at `url`.
+    Keys are cached for `ttl` seconds and refetched early, at most once a
+    minute, when a token names an unknown key.
+    '''
+    def __init__(self, url, ttl, algorithms, audience=None, issuer=None):
+        try:
+            import jwt
+        except ImportError:
+            raise RuntimeError("AUTH_JWKS_URL requires the pyjwt[crypto] package")
+        self.jwt = jwt
+        self.url = url
+        self.ttl = ttl
+        self.algorithms = algorithms
+        self.audience = audience
+        self.issuer = issuer
+        self.keys = {}
+        self.fetched_at = None
+        self.fetching = None
+
+    async def _fetch(self):
+        try:
+            resp = await get_client().get(self.url)
+            resp.raise_for_status()
+            keys = self.jwt.PyJWKSet.from_dict(resp.json()).keys
+        except Exception as e:
+            logger.warning("Could not fetch the JWKS from %s: %s", self.url, e)
+            return
+        self.keys = {key.key_id: key for key in keys}
+
+    async def _key(self, kid):
+        age = None if self.fetched_at is None else time.monotonic() - self.fetched_at
+        if self.fetching is None and (age is None or age > self.ttl or (kid not in self.keys and age > 60)):
+            self.fetched_at = time.monotonic()
+            self.fetching = asyncio.ensure_future(self._fetch())
+            self.fetching.add_done_callback(lambda task: setattr(self, 'fetching', None))
+        # known keys keep being used while they are refreshed
+        if self.fetching is not None and kid not in self.keys:
+            await asyncio.shield(self.fetching)
+        return self.keys.get(kid)
+
+    async def verify(self, token):
+        '''
+        Returns the claims of a valid token, or None for tokens that are not
+        signed by a known key and are left to the auth service. Raises
+        HTTPException for invalid or expired tokens.
+        '''
+        try:
+            header = self.jwt.get_unverified_header(token)
+        except self.jwt.InvalidTokenError:
+            return None
+        key = await self._key(header.get('kid'))
+        if key is None:
+            return None
+        try:
+            return self.jwt.decode(token, key.key, algorithms=self.algorithms,
+                                   audience=self.audience, issuer=self.issuer)
+        except self.jwt.InvalidTokenError as e:
+            raise HTTPException(status.HTTP_401_UNAUTHORIZED, f"Invalid token: {e}")
+
+
+def get_verifier():
+    url = os.environ.get("AUTH_JWKS_URL", None)
+    if not url:
+        return None
+    return JWKSVerifier(url, ttl=float(os.environ.get("AUTH_JWKS_TTL", 3600)),
+                        algorithms=os.environ.get("AUTH_JWT_ALGORITHMS", "RS256").split(","),
+                        audience=os.environ.get("AUTH_JWT_AUDIENCE", None),
+                        issuer=os.environ.get("AUTH_JWT_ISSUER", None))
+
+
+client = None
+breaker = CircuitBreaker(AUTH_BREAKER_FAILURES, AUTH_BREAKER_RESET)
+verifier = get_verifier()
+# profiles of tokens verified by the auth service, per worker. Off by default:
+# a cached token is still accepted for this long after it was revoked
+verified_tokens = TTLCache(ttl=float(os.environ.get("AUTH_CACHE_TTL", 0)), max_size=10000)
+# one upstream call per token at a time, concurrent requests wait for it
+inflight = {}
+
+def get_client():
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(AUTH_READ_TIMEOUT, connect=AUTH_CONNECT_TIMEOUT, pool=AUTH_POOL_TIMEOUT),
+            limits=httpx.Limits(max_connections=AUTH_MAX_CONNECTIONS))
+    return client
+
+async def close_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+async def _fetch_profile(url, headers):
+    if not breaker.allow():
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Authentication service unavailable",
+                            headers={"Retry-After": str(breaker.retry_after())})
+    try:
+        resp = await get_client().get(f"{url}api/v2/me/", headers=headers)
+    except httpx.PoolTimeout:
+        # saturated on our side, says nothing about the auth service
+        breaker.skip()
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Too many pending authentication requests",
+                            headers={"Retry-After": "1"})
+    except httpx.HTTPError as e:
+        logger.warning("Authentication service call failed: %r", e)
+        resp = None
+    except BaseException:
+        breaker.skip()
+        raise
+    if resp is None or resp.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+        breaker.failure()
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Authentication service unavailable",
+                            headers={"Retry-After": str(breaker.retry_after())})
+    breaker.success()
+    if resp.status_code != status.HTTP_200_OK:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Authentication credentials were not provided.")
+    # the profile identifies who made the change in the allocation log
+    try:
+        return resp.json()
+    except ValueError:
+        return None
+
+async def _profile(url, auth_token, client_id):
+    key = hashlib.sha256(f"{client_id}\n{auth_token}".encode()).hexdigest()
+    cached = verified_tokens.get(key)
+    if cached is not None:
+        return cached[0]
+    task = inflight.get(key)
+    if task is None:
+        headers = {"Authorization": auth_token, "Content-Type": "application/json"}
+        if client_id is not None:
+            headers["X-Client-Id"] = client_id
+        task = asyncio.ensure_future(_fetch_profile(url, headers))
+        inflight[key] = task
+        task.add_done_callback(lambda task: inflight.pop(key, None))
+    # a disconnecting client must not cancel the call the other requests wait for
+    profile = await asyncio.shield(task)
+    verified_tokens.set(key, (profile,))
+    return profile
+
+async def is_authenticated(request: Request):
     auth_token = request.headers.get('Authorization', None)
     url = os.environ.get("MYSRCM_URL", None)
     client_id = request.headers.get("X-Client-Id", None)
     if not url:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR\
                             , "MYSRCM_URL is not configured")
-    headers = {
-        "Authorization": auth_token,
-        "Content-Type": "application/json",
-        "X-Client-Id": client_id
-    }
-    resp = requests.get(f"{url}api/v2/me/", headers=headers)
-    if resp.status_code == status.HTTP_200_OK:
-        return True
-    else:
+    if not auth_token:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Authentication credentials were not provided.")
+
+    if verifier is not None:
+        scheme, _, token = auth_token.partition(' ')
+        claims = await verifier.verify(token if scheme.lower() == 'bearer' else auth_token)
+        if claims is not None:
+            # the allocation log identifies users by id or email, tokens by subject
+            claims.setdefault('id', claims.get('sub'))
+            request.state.user = claims
+            return True
+
+    request.state.user = await _profile(url, auth_token, client_id)
+    return True
@@ -0,0 +1,72 @@
+'''
+Invalidation of the cached dorm trees across processes. Writers that
+bypass the API, like the job worker, notify the dorms they changed in their
+transaction; every API worker listens and drops those trees when the
+transaction commits.
+'''
+import logging
+import os
+import select
+import threading
+import time
+import psycopg2
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from config.db import engine
+from cache import dorm_tree_cache
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'dorm_tree'
+# payload that invalidates every tree
+ALL = '*'
+
+
+def notify_dorm_trees(db, dorm_ids=None):
+    '''
+    Invalidate the trees of `dorm_ids`, or all of them, when the transaction
+    of `db` commits
+    '''
+    payloads = [ALL] if dorm_ids is None else [str(dorm_id) for dorm_id in dorm_ids]
+    for payload in payloads:
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {'channel': CHANNEL, 'payload': payload})
+
+def _invalidate(payload):
+    if payload == ALL:
+        dorm_tree_cache.clear()
+    else:
+        dorm_tree_cache.delete(payload)
+
+def _listen(url):
+    conn = psycopg2.connect(url)
+    try:
+        conn.autocommit = True
+        conn.cursor().execute(f"LISTEN {CHANNEL}")
+        # notifications sent while not listening are lost
+        dorm_tree_cache.clear()
+        while True:
+            if select.select([conn], [], [], 60) == ([], [], []):
+                # detects a connection that died silently
+                conn.cursor().execute("SELECT 1")
+                continue
+            conn.poll()
+            while conn.notifies:
+                _invalidate(conn.notifies.pop(0).payload)
+    finally:
+        conn.close()
+
+def start_listener():
+    if os.environ.get("DORM_TREE_LISTEN", "true").lower() == "false" or dorm_tree_cache.ttl <= 0:
+        return
+    url = engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+    def listen():
+        while True:
+            try:
+                _listen(url)
+            except Exception as e:
+                logger.warning("Dorm tree invalidation listener failed, reconnecting: %s", e)
+                time.sleep(5)
+    threading.Thread(target=listen, name="dorm-tree-listener", daemon=True).start()
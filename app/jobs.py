@@ -0,0 +1,223 @@
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from sqlalchemy import and_, func, or_, select, update
+
+from config.db import SessionLocal
+from models import Bed, Job, Room
+from schema import ArchiveParams, DeallocateBedsParams, PercentReleasedParams, RoomCountsParams
+import audit  # registers the allocation log hooks for the worker's sessions
+import quota  # and the room counter hooks
+import archive
+from invalidation import notify_dorm_trees
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.environ.get("JOB_CHUNK_SIZE", 500))
+# a running job without a heartbeat for this long is taken over by another worker
+STALE_AFTER = timedelta(seconds=int(os.environ.get("JOB_STALE_AFTER", 120)))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+
+
+class JobType:
+    '''
+    A bulk operation processed in chunks. `count` returns the number of items
+    to process, `run_chunk` processes the items after `cursor` and returns
+    (new cursor, items processed, done). `dorms` returns the ids of the dorms
+    whose cached trees a chunk changes, None for all of them.
+    '''
+    def __init__(self, params, count, run_chunk, dorms=lambda params: None):
+        self.params = params
+        self.count = count
+        self.run_chunk = run_chunk
+        self.dorms = dorms
+
+
+def _allocated_beds(db, params):
+    beds = db.query(Bed).join(Room, Bed.room_id==Room.id)\
+        .filter(Room.dorm_id==params.dorm_id, Bed.allocated==True)
+    if params.room_id is not None:
+        beds = beds.filter(Bed.room_id==params.room_id)
+    return beds
+
+def _deallocate_beds(db, params, cursor, chunk_size):
+    beds = _allocated_beds(db, params)
+    if cursor is not None:
+        beds = beds.filter(Bed.id > uuid.UUID(cursor))
+    ids = [id for id, in beds.with_entities(Bed.id).order_by(Bed.id).limit(chunk_size)]
+    if not ids:
+        return cursor, 0, True
+    # rooms before beds, in the same order as allocate_bed and release_bed:
+    # the commit updates the rooms' counters
+    db.query(Room.id).filter(Room.id.in_(select(Bed.room_id).where(Bed.id.in_(ids))))\
+        .order_by(Room.id).with_for_update().all()
+    beds = db.query(Bed).filter(Bed.id.in_(ids), Bed.allocated==True)\
+        .order_by(Bed.id).with_for_update().all()
+    for bed in beds:
+        bed.allocated = False
+    return str(ids[-1]), len(beds), len(ids) < chunk_size
+
+def _rooms_of_dorm(db, params):
+    return db.query(Room).filter(Room.dorm_id==params.dorm_id)
+
+def _set_percent_released(db, params, cursor, chunk_size):
+    rooms = _rooms_of_dorm(db, params)
+    if cursor is not None:
+        rooms = rooms.filter(Room.id > uuid.UUID(cursor))
+    rooms = rooms.order_by(Room.id).limit(chunk_size).with_for_update().all()
+    for room in rooms:
+        room.percent_released = params.percent_released
+    return (str(rooms[-1].id) if rooms else cursor), len(rooms), len(rooms) < chunk_size
+
+def _rooms(db, params):
+    rooms = db.query(Room)
+    if params.dorm_id is not None:
+        rooms = rooms.filter(Room.dorm_id==params.dorm_id)
+    return rooms
+
+def _rebuild_room_counts(db, params, cursor, chunk_size):
+    rooms = _rooms(db, params).with_entities(Room.id)
+    if cursor is not None:
+        rooms = rooms.filter(Room.id > uuid.UUID(cursor))
+    # lock first so the counts below see every allocation committed before them
+    ids = [id for id, in rooms.order_by(Room.id).limit(chunk_size).with_for_update()]
+    if ids:
+        beds = select(func.count(Bed.id)).where(Bed.room_id==Room.id, Bed.active.isnot(False))
+        db.execute(update(Room).where(Room.id.in_(ids))
+                   .values(bed_count=beds.scalar_subquery(),
+                           allocated_count=beds.where(Bed.allocated==True).scalar_subquery())
+                   .execution_options(synchronize_session=False))
+    return (str(ids[-1]) if ids else cursor), len(ids), len(ids) < chunk_size
+
+def _archive(db, params, cursor, chunk_size):
+    # the cursor is the level being archived, each level runs until nothing is left to move
+    level = cursor or archive.LEVELS[0]
+    moved = archive.archive_chunk(db, level, archive.cutoff(params.older_than_days), chunk_size)
+    if moved < chunk_size:
+        position = archive.LEVELS.index(level) + 1
+        if position == len(archive.LEVELS):
+            return level, moved, True
+        level = archive.LEVELS[position]
+    return level, moved, False
+
+
+JOB_TYPES = {
+    'deallocate_beds': JobType(DeallocateBedsParams,
+                               lambda db, params: _allocated_beds(db, params).count(),
+                               _deallocate_beds,
+                               lambda params: [params.dorm_id]),
+    'set_percent_released': JobType(PercentReleasedParams,
+                                    lambda db, params: _rooms_of_dorm(db, params).count(),
+                                    _set_percent_released,
+                                    lambda params: [params.dorm_id]),
+    'rebuild_room_counts': JobType(RoomCountsParams,
+                                   lambda db, params: _rooms(db, params).count(),
+                                   _rebuild_room_counts,
+                                   lambda params: None if params.dorm_id is None else [params.dorm_id]),
+    'archive': JobType(ArchiveParams,
+                       lambda db, params: archive.count(db, archive.cutoff(params.older_than_days)),
+                       _archive),
+}
+
+
+def validate(type, params):
+    '''
+    Returns the validated params of a job, raises ValueError if they are invalid
+    '''
+    job_type = JOB_TYPES.get(type)
+    if job_type is None:
+        raise ValueError(f"Unknown job type '{type}', expected one of {', '.join(JOB_TYPES)}")
+    try:
+        return job_type.params(**params).model_dump(mode='json')
+    except ValidationError as e:
+        raise ValueError(str(e))
+
+def claim(db):
+    '''
+    Take the oldest queued job, or a running job whose worker stopped sending
+    heartbeats. SKIP LOCKED lets any number of workers poll the same table.
+    Jobs out of attempts are failed on the way.
+    '''
+    while True:
+        now = datetime.utcnow()
+        job = db.query(Job).filter(or_(Job.status==Job.STATUSES.QUEUED.value,
+                                       and_(Job.status==Job.STATUSES.RUNNING.value,
+                                            Job.heartbeat_at < now - STALE_AFTER)))\
+            .order_by(Job.created_at).limit(1).with_for_update(skip_locked=True).one_or_none()
+        if job is None:
+            return None
+        job.attempts += 1
+        job.heartbeat_at = now
+        if job.attempts <= MAX_ATTEMPTS:
+            job.status = Job.STATUSES.RUNNING.value
+            db.commit()
+            return job
+        job.status = Job.STATUSES.FAILED.value
+        job.error = job.error or 'Too many attempts'
+        db.commit()
+
+def run(job_id, chunk_size=CHUNK_SIZE, should_stop=lambda: False):
+    '''
+    Process a claimed job chunk by chunk. Every chunk commits together with
+    the job's cursor and progress, so a job picks up where it stopped after
+    a crash, a restart or a retry.
+    '''
+    while True:
+        with SessionLocal() as db:
+            job = db.query(Job).filter(Job.id==job_id).with_for_update().one()
+            if job.status != Job.STATUSES.RUNNING.value:
+                # cancelled while running
+                return job.status
+            if should_stop():
+                # handed back on shutdown, not a failed attempt
+                job.status = Job.STATUSES.QUEUED.value
+                job.attempts -= 1
+                db.commit()
+                return job.status
+
+            job_type = JOB_TYPES[job.type]
+            params = job_type.params(**job.params)
+            db.info.update(actor=job.actor, client_id=job.client_id)
+            try:
+                if job.total is None:
+                    job.total = job_type.count(db, params)
+                cursor, processed, done = job_type.run_chunk(db, params, job.cursor, chunk_size)
+                if processed:
+                    # the API workers drop the cached trees when this commits
+                    notify_dorm_trees(db, job_type.dorms(params))
+                # autoflush is off: the chunk's writes and their audit and
+                # counter hooks would otherwise only run in the commit below
+                db.flush()
+            except Exception as e:
+                db.rollback()
+                logger.exception("Job %s failed", job_id)
+                return fail(job_id, e)
+
+            job.cursor = cursor
+            job.processed = (job.processed or 0) + processed
+            job.heartbeat_at = datetime.utcnow()
+            if done:
+                job.status = Job.STATUSES.SUCCEEDED.value
+            db.commit()
+            if done:
+                return job.status
+
+def fail(job_id, error):
+    with SessionLocal() as db:
+        job = db.query(Job).filter(Job.id==job_id).with_for_update().one()
+        job.error = str(error)
+        # retried from its cursor until it runs out of attempts
+        job.status = Job.STATUSES.QUEUED.value if job.attempts < MAX_ATTEMPTS else Job.STATUSES.FAILED.value
+        db.commit()
+        return job.status
+
+def cancel(db, job):
+    if job.status in (Job.STATUSES.QUEUED.value, Job.STATUSES.RUNNING.value):
+        job.status = Job.STATUSES.CANCELLED.value
+        db.commit()
+        db.refresh(job)
+    return job
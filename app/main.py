@@ -1,13 +1,39 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api import router, dorm_router, room_router, bed_router
+from api import router, dorm_router, room_router, bed_router, availability_router, report_router, \
+    job_router, release_router, archive_router
+from availability import start_index
+from audit import ensure_partitions
+from invalidation import start_listener
+from middleware import RateLimitMiddleware, CompressionMiddleware
+import deps
 
 app = FastAPI()
 
+@app.on_event("startup")
+def load_availability_index():
+    start_index()
+
+@app.on_event("startup")
+def create_allocation_event_partitions():
+    ensure_partitions()
+
+@app.on_event("startup")
+def listen_for_dorm_tree_invalidations():
+    start_listener()
+
+@app.on_event("shutdown")
+async def close_auth_client():
+    await deps.close_client()
+
 origins = [
     "http://localhost:3000",
 ]
 
+# shed abusive clients before they reach the db pool or the auth service,
+# registered first so that CORS headers are still added to 429/503 responses
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -16,7 +42,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# outermost, so that every response is compressed once, whatever produced it
+app.add_middleware(CompressionMiddleware)
+
 app.include_router(router)
 app.include_router(dorm_router, prefix='/dorms', tags=["dorms"])
 app.include_router(room_router, prefix='/dorms/{dorm_id}/rooms', tags=["rooms"])
-app.include_router(bed_router, prefix='/dorms/{dorm_id}/rooms/{room_id}/beds', tags=["beds"])
\ No newline at end of file
+app.include_router(bed_router, prefix='/dorms/{dorm_id}/rooms/{room_id}/beds', tags=["beds"])
+app.include_router(availability_router, prefix='/availability', tags=["availability"])
+app.include_router(report_router, prefix='/reports', tags=["reports"])
+app.include_router(job_router, prefix='/jobs', tags=["jobs"])
+app.include_router(release_router, prefix='/release-waves', tags=["release waves"])
+app.include_router(archive_router, prefix='/archive', tags=["archive"])
\ No newline at end of file
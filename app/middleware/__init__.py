@@ -0,0 +1,2 @@
+from middleware.ratelimit import RateLimitMiddleware
+from middleware.compression import CompressionMiddleware
@@ -0,0 +1,158 @@
+import os
+import zlib
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+
+load_dotenv()
+
+# Responses smaller than this are sent as they are, compressing them costs
+# more CPU than the bytes saved are worth
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+# Moderate levels: on JSON the highest ones cost several times the CPU for a few percent
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 4))
+
+
+class GzipEncoder:
+    def __init__(self):
+        self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self):
+        import brotli
+        self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def get_encoders():
+    '''
+    The encodings offered, in order of preference. Brotli needs the optional
+    brotli package, without it only gzip is offered.
+    '''
+    encoders = {}
+    try:
+        import brotli
+        encoders['br'] = BrotliEncoder
+    except ImportError:
+        pass
+    encoders['gzip'] = GzipEncoder
+    return encoders
+
+
+def negotiate(accept_encoding, encodings):
+    '''
+    Picks the encoding the client accepts with the highest q-value, the
+    order of `encodings` breaking ties. Returns None for identity.
+    '''
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    '''
+    Compresses response bodies of at least `minimum_size` bytes with brotli
+    or gzip, whichever the client prefers in Accept-Encoding.
+    '''
+    def __init__(self, app, minimum_size=None, encoders=None):
+        self.app = app
+        self.minimum_size = COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+        self.encoders = encoders or get_encoders()
+        self.enabled = os.environ.get("COMPRESSION_ENABLED", "true").lower() != "false"
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.enabled:
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''), self.encoders)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        responder = CompressionResponder(self.app, encoding, self.encoders[encoding], self.minimum_size)
+        await responder(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app, encoding, encoder, minimum_size):
+        self.app = app
+        self.encoding = encoding
+        self.encoder = encoder
+        self.minimum_size = minimum_size
+        self.send = None
+        self.initial_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def start_compressing(self):
+        headers = MutableHeaders(raw=self.initial_message['headers'])
+        headers['Content-Encoding'] = self.encoding
+        headers.add_vary_header('Accept-Encoding')
+        # the compressed body is a different representation of the same resource
+        etag = headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            headers['ETag'] = f'W/{etag}'
+        del headers['Content-Length']
+        self.compressor = self.encoder()
+        return headers
+
+    async def send_compressed(self, message):
+        if message['type'] == 'http.response.start':
+            # held back until the first body chunk tells whether to compress
+            self.initial_message = message
+            self.passthrough = 'content-encoding' in Headers(raw=message['headers'])
+            return
+        if message['type'] != 'http.response.body' or self.passthrough:
+            if self.initial_message is not None:
+                await self.send(self.initial_message)
+                self.initial_message = None
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if self.compressor is None:
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            headers = self.start_compressing()
+            body = self.compressor.compress(body)
+            if not more_body:
+                body += self.compressor.finish()
+                headers['Content-Length'] = str(len(body))
+            await self.send(self.initial_message)
+            self.initial_message = None
+        else:
+            body = self.compressor.compress(body)
+            if not more_body:
+                body += self.compressor.finish()
+        await self.send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
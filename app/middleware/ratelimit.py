@@ -0,0 +1,247 @@
+import math
+import os
+import re
+import time
+from dotenv import load_dotenv
+from starlette.responses import JSONResponse
+
+load_dotenv()
+
+# Route classes. Reads are cheap, writes hold a transaction, bulk operations
+# can keep a connection busy for a long time - so each gets its own budget.
+READ = 'read'
+WRITE = 'write'
+BULK = 'bulk'
+
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Paths matching any of these patterns are treated as bulk operations
+BULK_PATHS = [
+    re.compile(r'^/jobs/?$'),
+    re.compile(r'^/release-waves/?$'),
+    # restores move everything archived under a dorm or room
+    re.compile(r'^/archive/(dorms|rooms|beds)/[^/]+/restore/?$'),
+]
+
+# (tokens per second, bucket size, max in-flight requests) per route class
+DEFAULT_LIMITS = {
+    READ: (20.0, 40, 10),
+    WRITE: (5.0, 10, 4),
+    BULK: (0.2, 2, 1),
+}
+
+# Max in-flight requests per route class across all clients of a worker.
+# Client ids are not verified, so the per-client budgets alone do not bound
+# the load; together these stay within the default db pool (5 + 10 overflow).
+DEFAULT_GLOBAL_CONCURRENCY = {
+    READ: 10,
+    WRITE: 4,
+    BULK: 1,
+}
+
+# Upper bound on buckets kept by the in-memory backend before idle ones are dropped
+MAX_KEYS = 10000
+
+
+def get_limits():
+    '''
+    Read the limits from the environment, e.g. RATE_LIMIT_READ_RATE=20,
+    RATE_LIMIT_READ_BURST=40, RATE_LIMIT_READ_CONCURRENCY=10
+    '''
+    limits = {}
+    for route_class, (rate, burst, concurrency) in DEFAULT_LIMITS.items():
+        prefix = f"RATE_LIMIT_{route_class.upper()}"
+        limits[route_class] = (
+            float(os.environ.get(f"{prefix}_RATE", rate)),
+            int(os.environ.get(f"{prefix}_BURST", burst)),
+            int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency)),
+        )
+    return limits
+
+
+def get_global_limits():
+    '''
+    e.g. RATE_LIMIT_READ_GLOBAL_CONCURRENCY=10, 0 disables the cap
+    '''
+    return {route_class: int(os.environ.get(f"RATE_LIMIT_{route_class.upper()}_GLOBAL_CONCURRENCY", limit))
+            for route_class, limit in DEFAULT_GLOBAL_CONCURRENCY.items()}
+
+
+def classify(method, path):
+    if any(pattern.search(path) for pattern in BULK_PATHS):
+        return BULK
+    if method in READ_METHODS:
+        return READ
+    return WRITE
+
+
+class MemoryBackend:
+    '''
+    Per-worker token buckets and in-flight counters. Everything runs on the
+    event loop, so no locking is needed.
+    '''
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.in_flight = {}
+
+    def _prune(self, now):
+        # drop buckets that have refilled completely, they carry no state
+        for key, (tokens, updated, rate, burst) in list(self.buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self.buckets[key]
+
+    async def take_token(self, key, rate, burst):
+        '''
+        Returns 0 if a token was taken, otherwise the seconds until one is available
+        '''
+        now = time.monotonic()
+        tokens, updated, _, _ = self.buckets.get(key, (burst, now, rate, burst))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now, rate, burst)
+            return (1 - tokens) / rate if rate > 0 else 60.0
+        if key not in self.buckets and len(self.buckets) >= self.max_keys:
+            self._prune(now)
+        self.buckets[key] = (tokens - 1, now, rate, burst)
+        return 0
+
+    async def acquire_slot(self, key, limit):
+        count = self.in_flight.get(key, 0)
+        if count >= limit:
+            return False
+        self.in_flight[key] = count + 1
+        return True
+
+    async def release_slot(self, key):
+        count = self.in_flight.get(key, 0) - 1
+        if count > 0:
+            self.in_flight[key] = count
+        else:
+            self.in_flight.pop(key, None)
+
+
+# Refills and takes a token atomically. Returns the wait in milliseconds, 0 if allowed.
+TOKEN_BUCKET_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local wait = 0
+if tokens < 1 then
+    wait = math.ceil((1 - tokens) / rate * 1000)
+else
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return wait
+'''
+
+
+class RedisBackend:
+    '''
+    Shares the buckets and counters across workers and hosts through Redis
+    '''
+    def __init__(self, url, prefix='ratelimit'):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self.token_bucket = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take_token(self, key, rate, burst):
+        wait = await self.token_bucket(keys=[f"{self.prefix}:tb:{key}"],
+                                       args=[rate, burst, time.time()])
+        return int(wait) / 1000
+
+    async def acquire_slot(self, key, limit):
+        name = f"{self.prefix}:cc:{key}"
+        count = await self.client.incr(name)
+        # guard against counters leaked by a crashed worker
+        await self.client.expire(name, 60)
+        if count > limit:
+            await self.client.decr(name)
+            return False
+        return True
+
+    async def release_slot(self, key):
+        await self.client.decr(f"{self.prefix}:cc:{key}")
+
+
+def get_backend():
+    backend = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+    if backend == "memory":
+        return MemoryBackend()
+    if backend == "redis":
+        url = os.environ.get("RATE_LIMIT_REDIS_URL", None)
+        if not url:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is not configured")
+        return RedisBackend(url)
+    raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND '{backend}'")
+
+
+class RateLimitMiddleware:
+    '''
+    Sheds requests per X-Client-Id and route class before they reach the
+    database session or the upstream auth call. Exhausted rate budgets get
+    a 429 and a saturated concurrency budget a 503, both with Retry-After.
+    Each route class also has a cap on in-flight requests of the worker,
+    whatever the client.
+    '''
+    def __init__(self, app, backend=None, limits=None, global_limits=None):
+        self.app = app
+        self.backend = backend or get_backend()
+        self.limits = limits or get_limits()
+        self.global_limits = global_limits or get_global_limits()
+        self.in_flight = {route_class: 0 for route_class in self.global_limits}
+        self.enabled = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() != "false"
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.enabled:
+            return await self.app(scope, receive, send)
+
+        route_class = classify(scope['method'], scope['path'])
+        rate, burst, concurrency = self.limits[route_class]
+        key = f"{client_key(scope)}:{route_class}"
+
+        wait = await self.backend.take_token(key, rate, burst)
+        if wait:
+            response = reject(status_code=429, detail='Too many requests', retry_after=wait)
+            return await response(scope, receive, send)
+
+        # runs on the event loop, no await between the check and the increment
+        limit = self.global_limits.get(route_class, 0)
+        if limit and self.in_flight[route_class] >= limit:
+            response = reject(status_code=503, detail='Server busy', retry_after=1)
+            return await response(scope, receive, send)
+        self.in_flight[route_class] += 1
+        try:
+            if not await self.backend.acquire_slot(key, concurrency):
+                response = reject(status_code=503, detail='Too many concurrent requests', retry_after=1)
+                return await response(scope, receive, send)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                await self.backend.release_slot(key)
+        finally:
+            self.in_flight[route_class] -= 1
+
+
+def client_key(scope):
+    for name, value in scope['headers']:
+        if name == b'x-client-id' and value:
+            return 'client:' + value.decode('latin-1')
+    # requests without a client id still get a budget, per remote address
+    client = scope.get('client')
+    return 'ip:' + (client[0] if client else 'unknown')
+
+
+def reject(status_code, detail, retry_after):
+    return JSONResponse({'detail': detail}, status_code=status_code,
+                        headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
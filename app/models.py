@@ -1,5 +1,6 @@
 from enum import Enum
-from sqlalchemy import Boolean, Column, event, ForeignKey, Integer, JSON, String, VARCHAR, Text, DateTime
+from sqlalchemy import BigInteger, Boolean, Column, event, ForeignKey, func, Identity, Index, Integer, JSON, String, Table, VARCHAR, Text, DateTime
+from sqlalchemy import text
 from sqlalchemy import types
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -15,6 +16,11 @@ class BaseModel(Base):
 
 class Dorm(BaseModel):
     __tablename__ = "dorm"
+    __table_args__ = (
+        # partial indexes stay the size of the live inventory, see archive.py
+        Index("ix_dorm_created_at_active", "created_at", postgresql_where=text("active = true")),
+        Index("ix_dorm_updated_at_inactive", "updated_at", postgresql_where=text("active = false")),
+    )
 
     class DORM_TYPES(str, Enum):
         EAST_BUNK_BED = 'east_bunk_bed'
@@ -46,6 +52,12 @@ class Dorm(BaseModel):
 
 class Room(BaseModel):
     __tablename__ = "room"
+    __table_args__ = (
+        # names are unique within a dorm; the index also serves lookups by dorm
+        Index("ix_room_dorm_id_name", "dorm_id", "name", unique=True),
+        Index("ix_room_dorm_id_created_at_active", "dorm_id", "created_at", postgresql_where=text("active = true")),
+        Index("ix_room_updated_at_inactive", "updated_at", postgresql_where=text("active = false")),
+    )
 
     class FLOORS(str, Enum):
         GF = 'gf'
@@ -74,7 +86,7 @@ class Room(BaseModel):
             return [(key.value, key.name) for key in cls]
         
     id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True, index=True)
-    name = Column(String, nullable=False, index=True)
+    name = Column(String, nullable=False)
     dorm_id = Column(UUID, ForeignKey(Dorm.id), nullable=False)
     room_identifier = Column(Integer, nullable=False)
     ac_available = Column(Boolean, default=False)
@@ -88,6 +100,9 @@ class Room(BaseModel):
     participant_type = Column(types.Enum(*[i[0] for i in PARTICIPANT_TYPES.choices()], name="participant_type"), nullable=False)
     reset_allowed = Column(Boolean, default=False)
     active = Column(Boolean, default=True)
+    # maintained on every bed flush, see quota.py
+    bed_count = Column(Integer, nullable=False, default=0, server_default='0')
+    allocated_count = Column(Integer, nullable=False, default=0, server_default='0')
 
     # relationships
     dorm = relationship("Dorm", back_populates="rooms")
@@ -95,6 +110,14 @@ class Room(BaseModel):
 
 class Bed(BaseModel):
     __tablename__ = "bed"
+    __table_args__ = (
+        # names are unique within a room; the index also serves lookups by room
+        Index("ix_bed_room_id_name", "room_id", "name", unique=True),
+        Index("ix_bed_room_id_created_at_active", "room_id", "created_at", postgresql_where=text("active = true")),
+        Index("ix_bed_room_id_free", "room_id",
+              postgresql_where=text("active = true AND blocked = false AND allocated = false")),
+        Index("ix_bed_updated_at_inactive", "updated_at", postgresql_where=text("active = false")),
+    )
 
     class LEVELS(str, Enum):
         LOWER = 'lower'
@@ -105,7 +128,7 @@ class Bed(BaseModel):
             return [(key.value, key.name) for key in cls]
         
     id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True, index=True)
-    name = Column(String, nullable=False, index=True)
+    name = Column(String, nullable=False)
     room_id = Column(UUID, ForeignKey(Room.id), nullable=False)
     number = Column(Integer)
     blocked = Column(Boolean, default=False)
@@ -117,3 +140,73 @@ class Bed(BaseModel):
 
     # relationships
     room = relationship("Room", back_populates="beds")
+
+def _archive_table(table, parent=None):
+    '''
+    Cold copy of a table holding its archived rows, same columns without the
+    foreign keys and indexes of the live table
+    '''
+    columns = [Column(column.name, column.type.copy(), primary_key=column.primary_key)
+               for column in table.columns]
+    columns.append(Column('archived_at', DateTime, nullable=False, server_default=func.now()))
+    if parent is not None:
+        columns.append(Index(f"ix_{table.name}_archive_{parent}", parent))
+    return Table(f"{table.name}_archive", Base.metadata, *columns)
+
+DormArchive = _archive_table(Dorm.__table__)
+RoomArchive = _archive_table(Room.__table__, 'dorm_id')
+BedArchive = _archive_table(Bed.__table__, 'room_id')
+# allocated archived beds still anchor the occupancy report, see audit.py
+Index("ix_bed_archive_room_id_allocated", BedArchive.c.room_id, postgresql_where=text("allocated = true"))
+
+class Job(BaseModel):
+    __tablename__ = "job"
+    __table_args__ = (
+        Index("ix_job_status_created_at", "status", "created_at"),
+    )
+
+    class STATUSES(str, Enum):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        SUCCEEDED = 'succeeded'
+        FAILED = 'failed'
+        CANCELLED = 'cancelled'
+
+        @classmethod
+        def choices(cls):
+            return [(key.value, key.name) for key in cls]
+
+    id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True, index=True)
+    type = Column(String, nullable=False)
+    params = Column(JSON, nullable=False, default=dict)
+    status = Column(types.Enum(*[i[0] for i in STATUSES.choices()], name="job_status"), nullable=False, default=STATUSES.QUEUED.value)
+    total = Column(Integer, nullable=True)
+    processed = Column(Integer, default=0)
+    cursor = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    heartbeat_at = Column(DateTime, nullable=True)
+    actor = Column(String, nullable=True)
+    client_id = Column(String, nullable=True)
+
+class AllocationEvent(Base):
+    '''
+    Append-only log of bed state changes, range partitioned by month on created_at
+    '''
+    __tablename__ = "allocation_event"
+    __table_args__ = (
+        Index("ix_allocation_event_bed_id_created_at", "bed_id", "created_at"),
+        Index("ix_allocation_event_room_id_created_at", "room_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow, primary_key=True)
+    bed_id = Column(UUID(as_uuid=True), nullable=False)
+    room_id = Column(UUID(as_uuid=True), nullable=False)
+    actor = Column(String, nullable=True)
+    client_id = Column(String, nullable=True)
+    from_allocated = Column(Boolean, nullable=True)
+    to_allocated = Column(Boolean, nullable=True)
+    from_blocked = Column(Boolean, nullable=True)
+    to_blocked = Column(Boolean, nullable=True)
@@ -0,0 +1,96 @@
+from collections import defaultdict
+from sqlalchemy import bindparam, column, event, func, inspect, Integer, literal, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+
+from config.db import SessionLocal
+from models import Bed, Room
+from audit import value_change
+
+
+def released_beds(bed_count, percent_released):
+    '''
+    ceil(beds * percent_released / 100); rooms without a percentage are fully released
+    '''
+    percent = 100 if percent_released is None else percent_released
+    return (bed_count * percent + 99) // 100
+
+def released_beds_expression():
+    # floor division, integer / on Postgres: same result as released_beds
+    return (Room.bed_count * func.coalesce(Room.percent_released, 100) + 99) // 100
+
+def remaining_beds_expression():
+    return released_beds_expression() - Room.allocated_count
+
+
+def _counts(active, allocated):
+    counted = active is not False
+    return (1 if counted else 0), (1 if counted and allocated else 0)
+
+def _update_room_counters(session, flush_context):
+    '''
+    Keeps room.bed_count and room.allocated_count in step with the beds
+    written in this flush, in the same transaction
+    '''
+    deltas = defaultdict(lambda: [0, 0])
+    for bed in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(bed, Bed):
+            continue
+        state = inspect(bed)
+        room_before, room_after = value_change(state, 'room_id')
+        active_before, active_after = value_change(state, 'active')
+        allocated_before, allocated_after = value_change(state, 'allocated')
+        if bed not in session.new:
+            beds, allocated = _counts(active_before, allocated_before)
+            deltas[room_before][0] -= beds
+            deltas[room_before][1] -= allocated
+        if bed not in session.deleted:
+            beds, allocated = _counts(active_after, allocated_after)
+            deltas[room_after][0] += beds
+            deltas[room_after][1] += allocated
+    rows = [{'room': room, 'beds': beds, 'allocated': allocated}
+            for room, (beds, allocated) in deltas.items() if beds or allocated]
+    if not rows:
+        return
+    table = Room.__table__
+    session.connection().execute(
+        update(table).where(table.c.id == bindparam('room'))
+        .values(bed_count=table.c.bed_count + bindparam('beds'),
+                allocated_count=table.c.allocated_count + bindparam('allocated')),
+        rows)
+
+event.listen(SessionLocal, 'after_flush', _update_room_counters)
+
+# the counters need the previous values of beds changed after being expired
+for attribute in ('room_id', 'active'):
+    event.listen(getattr(Bed, attribute), 'set', lambda *args: None, active_history=True)
+
+
+def release_wave(db, percent_released=None, dorm_ids=None, participant_type=None, rooms=None):
+    '''
+    Set percent_released on every room selected by the filters and/or on the
+    rooms in `rooms` (room id -> percent), with set-based UPDATEs in the
+    caller's transaction so the wave is released everywhere or nowhere.
+    A room both matched by the filters and in `rooms` gets its own percent.
+    Returns the (room id, dorm id, percent released) of the updated rooms.
+    '''
+    table = Room.__table__
+    updated = []
+    if percent_released is not None and (dorm_ids or participant_type):
+        query = update(table).values(percent_released=percent_released)
+        if dorm_ids:
+            query = query.where(table.c.dorm_id.in_(dorm_ids))
+        if participant_type:
+            query = query.where(table.c.participant_type == participant_type)
+        if rooms:
+            # updated once, below
+            query = query.where(table.c.id.not_in(list(rooms)))
+        updated += db.execute(query.returning(table.c.id, table.c.dorm_id, table.c.percent_released)).all()
+
+    if rooms:
+        # two array parameters, whatever the size of the wave
+        wave = func.unnest(literal(list(rooms), ARRAY(UUID(as_uuid=True))),
+                           literal(list(rooms.values()), ARRAY(Integer)))\
+            .table_valued(column('id', UUID(as_uuid=True)), column('percent', Integer)).render_derived(name='wave')
+        query = update(table).where(table.c.id == wave.c.id).values(percent_released=wave.c.percent)
+        updated += db.execute(query.returning(table.c.id, table.c.dorm_id, table.c.percent_released)).all()
+    return updated
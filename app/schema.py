@@ -1,9 +1,10 @@
-from pydantic import BaseModel, Field
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field, conint
 from pydantic._internal._model_construction import ModelMetaclass
-from models import Dorm, Room, Bed
+from models import Dorm, Room, Bed, Job
 import uuid
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List, get_args
 
 class BasePydantic(BaseModel):
     class Config:
@@ -27,7 +28,7 @@ class DormPydanticRead(BasePydantic):
     updated_at: Optional[datetime]
     name: str
     type: Dorm.DORM_TYPES
-    description: str = None
+    description: Optional[str] = None
     amount: int
     amount_for: Dorm.AMOUNT_FOR_TYPES
     active: bool = True
@@ -89,13 +90,15 @@ class RoomResponse(ReadOnly):
     floor: Room.FLOORS
     close_to_dorm_entrance: bool
     close_to_bath: bool
-    percent_released: int
+    percent_released: Optional[int]
     bed_type: Room.BED_TYPES
     is_multibatch: bool
     max_count: int
     participant_type: Room.PARTICIPANT_TYPES
     reset_allowed: bool
     active: bool
+    bed_count: int
+    allocated_count: int
 
 class PaginatedRoomResponse(BaseModel):
     count: int
@@ -127,4 +130,153 @@ class BedResponse(ReadOnly):
 
 class PaginatedBedResponse(BaseModel):
     count: int
-    results: List[BedResponse]
\ No newline at end of file
+    results: List[BedResponse]
+
+class RoomTreeResponse(RoomResponse):
+    beds: List[BedResponse]
+
+class DormTreeResponse(DormPydanticRead):
+    rooms: List[RoomTreeResponse]
+
+def _nested_model(annotation):
+    for arg in get_args(annotation):
+        if isinstance(arg, type) and issubclass(arg, BaseModel):
+            return arg
+    return None
+
+def parse_fields(fields: str, model) -> dict:
+    '''
+    Turns "name,rooms.name,rooms.beds.allocated" into a projection spec for
+    `project`. The id of every object is always kept. Raises ValueError for
+    unknown fields.
+    '''
+    spec = {}
+    for path in filter(None, (f.strip() for f in fields.split(','))):
+        node, current = spec, model
+        parts = path.split('.')
+        for i, part in enumerate(parts):
+            if part not in current.model_fields:
+                raise ValueError(f"Unknown field '{path}'")
+            if 'id' in current.model_fields:
+                node.setdefault('id', True)
+            if i == len(parts) - 1:
+                node[part] = True
+                break
+            nested = _nested_model(current.model_fields[part].annotation)
+            if nested is None:
+                raise ValueError(f"Unknown field '{path}'")
+            if node.get(part) is True:
+                break
+            node = node.setdefault(part, {})
+            current = nested
+    return spec
+
+def project(data, spec):
+    '''
+    Keeps only the fields selected by `spec` in serialized data
+    '''
+    if spec is True or not spec:
+        return data
+    if isinstance(data, list):
+        return [project(item, spec) for item in data]
+    return {key: project(data[key], value) for key, value in spec.items() if key in data}
+
+def parse_columns(fields: str, model, entity) -> list:
+    '''
+    Turns "name,allocated" into the columns of `entity` to select for the
+    flat response `model`, the id first. Raises ValueError for unknown fields.
+    '''
+    return [getattr(entity, name) for name in parse_fields(fields, model)]
+
+def serialize_rows(rows) -> list:
+    '''
+    Serializes rows selected with `parse_columns`, without the full response model
+    '''
+    return jsonable_encoder([row._asdict() for row in rows])
+
+class AvailableBed(BaseModel):
+    id: uuid.UUID
+    room_id: uuid.UUID
+    dorm_id: uuid.UUID
+
+class AvailableBedsResponse(BaseModel):
+    source: str
+    results: List[AvailableBed]
+
+class AllocationEventResponse(ReadOnly):
+    id: int
+    created_at: datetime
+    bed_id: uuid.UUID
+    room_id: uuid.UUID
+    actor: Optional[str]
+    client_id: Optional[str]
+    from_allocated: Optional[bool]
+    to_allocated: Optional[bool]
+    from_blocked: Optional[bool]
+    to_blocked: Optional[bool]
+
+class PaginatedAllocationEventResponse(BaseModel):
+    count: int
+    results: List[AllocationEventResponse]
+
+class OccupancyBucket(BaseModel):
+    bucket: datetime
+    allocated: int
+    released: int
+    occupancy: int
+
+class OccupancyReportResponse(BaseModel):
+    results: List[OccupancyBucket]
+
+class DeallocateBedsParams(BaseModel):
+    dorm_id: uuid.UUID
+    room_id: Optional[uuid.UUID] = None
+
+class PercentReleasedParams(BaseModel):
+    dorm_id: uuid.UUID
+    percent_released: int = Field(..., ge=0, le=100)
+
+class RoomCountsParams(BaseModel):
+    dorm_id: Optional[uuid.UUID] = None
+
+class ArchiveParams(BaseModel):
+    # inactive rows untouched for this many days, ARCHIVE_AFTER_DAYS by default
+    older_than_days: Optional[conint(ge=0)] = None
+
+class JobCreate(BaseModel):
+    type: str = Field(..., title="Type", description="Job type, e.g. deallocate_beds")
+    params: dict = Field({}, title="Params", description="Parameters of the job type")
+
+class JobResponse(ReadOnly):
+    id: uuid.UUID
+    created_at: datetime
+    updated_at: datetime
+    type: str
+    params: dict
+    status: Job.STATUSES
+    total: Optional[int]
+    processed: int
+    error: Optional[str]
+    attempts: int
+
+class ReleaseWave(BaseModel):
+    percent_released: Optional[int] = Field(None, ge=0, le=100, title="Percent Released",
+                                            description="Applied to all rooms matching dorm_ids/participant_type")
+    dorm_ids: Optional[List[uuid.UUID]] = Field(None, title="Dorm Ids", description="Dorms to release")
+    participant_type: Optional[Room.PARTICIPANT_TYPES] = Field(None, title="Participant Type", description="Participant Type")
+    rooms: Dict[uuid.UUID, conint(ge=0, le=100)] = Field({}, title="Rooms", description="Percent released per room id")
+
+class ReleaseWaveResponse(BaseModel):
+    updated: int
+
+class ArchivedDormResponse(DormPydanticRead):
+    archived_at: datetime
+
+class PaginatedArchivedDormResponse(BaseModel):
+    count: int
+    results: List[ArchivedDormResponse]
+
+class RestoreResponse(BaseModel):
+    dorm: int = 0
+    room: int = 0
+    bed: int = 0
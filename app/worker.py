@@ -0,0 +1,64 @@
+'''
+Background job worker. Run next to the API, as many instances as needed:
+
+    python worker.py
+'''
+import logging
+import os
+import signal
+import time
+from dotenv import load_dotenv
+
+from config.db import SessionLocal
+import audit
+import jobs
+
+load_dotenv()
+logger = logging.getLogger("worker")
+
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2))
+# how often the allocation_event partitions of the coming months are created
+PARTITION_INTERVAL = float(os.environ.get("AUDIT_PARTITION_INTERVAL", 3600))
+
+stopping = False
+
+def stop(signum, frame):
+    # finish the current chunk, the job is re-queued from its cursor
+    global stopping
+    stopping = True
+
+def main():
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Worker started")
+    partitioned_at = None
+    while not stopping:
+        # the API only does this at startup, long running instances would run out of partitions
+        if partitioned_at is None or time.monotonic() - partitioned_at > PARTITION_INTERVAL:
+            audit.ensure_partitions()
+            partitioned_at = time.monotonic()
+        with SessionLocal() as db:
+            job = jobs.claim(db)
+            job_id, job_type = (job.id, job.type) if job else (None, None)
+        if job_id is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        logger.info("Running job %s (%s)", job_id, job_type)
+        try:
+            status = jobs.run(job_id, should_stop=lambda: stopping)
+        except Exception as e:
+            # e.g. the database going away, keep polling instead of exiting
+            logger.exception("Job %s crashed", job_id)
+            try:
+                status = jobs.fail(job_id, e)
+            except Exception:
+                # the job is taken over once its heartbeat goes stale
+                logger.exception("Could not record the failure of job %s", job_id)
+                time.sleep(POLL_INTERVAL)
+                continue
+        logger.info("Job %s %s", job_id, status)
+    logger.info("Worker stopped")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
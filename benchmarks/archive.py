@@ -0,0 +1,103 @@
+'''
+Live query latency and index size with years of past events in the hot tables,
+before and after archiving them, against a real Postgres.
+
+    DB_STRING=postgresql://... python benchmarks/archive.py [number of past events]
+
+Every event is a dorm of 2500 rooms with 40 beds each; the past ones are
+inactive. Runs inside a transaction that is rolled back at the end.
+'''
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from sqlalchemy import desc, text
+
+from config.db import SessionLocal
+from models import Bed, Dorm, Room
+from archive import archive_chunk, LEVELS
+from quota import remaining_beds_expression
+
+ROOMS = 2500
+BEDS_PER_ROOM = 40
+INDEXES = ['ix_bed_room_id_name', 'ix_bed_room_id_created_at_active', 'ix_bed_room_id_free',
+           'ix_room_dorm_id_name', 'ix_room_dorm_id_created_at_active']
+
+
+def event(db, name, active, updated_at):
+    dorm_id = db.execute(text('''
+        INSERT INTO dorm (id, name, type, amount, amount_for, active, created_at, updated_at)
+        VALUES (gen_random_uuid(), :name, 'east_bunk_bed', 0, 'event', :active, :updated_at, :updated_at)
+        RETURNING id
+    '''), {'name': name, 'active': active, 'updated_at': updated_at}).scalar()
+    db.execute(text('''
+        INSERT INTO room (id, name, dorm_id, room_identifier, floor, bed_type, participant_type,
+                          percent_released, active, bed_count, allocated_count, created_at, updated_at)
+        SELECT gen_random_uuid(), 'room ' || n, :dorm, n, 'gf', 'bunk', 'general', 100, :active, :beds, 0,
+               :updated_at, :updated_at
+        FROM generate_series(1, :rooms) AS n
+    '''), {'dorm': dorm_id, 'active': active, 'rooms': ROOMS, 'beds': BEDS_PER_ROOM, 'updated_at': updated_at})
+    db.execute(text('''
+        INSERT INTO bed (id, name, room_id, number, level, allocated, blocked, active, created_at, updated_at)
+        SELECT gen_random_uuid(), 'bed ' || n, room.id, n, 'lower', n % 3 = 0, false, :active,
+               :updated_at, :updated_at
+        FROM room, generate_series(1, :beds) AS n
+        WHERE room.dorm_id = :dorm
+    '''), {'dorm': dorm_id, 'active': active, 'beds': BEDS_PER_ROOM, 'updated_at': updated_at})
+    return dorm_id
+
+
+def timed(label, function, repeat=200):
+    function()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    print(f"  {label:<44} {(time.perf_counter() - started) / repeat * 1e6:8.0f}us")
+
+
+def measure(db, dorm_id, room_id):
+    db.execute(text('ANALYZE dorm; ANALYZE room; ANALYZE bed'))
+    for name in INDEXES:
+        size = db.execute(text("SELECT pg_relation_size(CAST(:name AS regclass))"), {'name': name}).scalar()
+        print(f"  {name:<44} {size / 2**20:8.1f} MiB")
+    timed("list active rooms of the live dorm", lambda: db.query(Room)
+          .filter(Room.dorm_id==dorm_id, Room.active==True).order_by(desc(Room.created_at)).limit(20).all())
+    timed("list active beds of a live room", lambda: db.query(Bed)
+          .filter(Bed.room_id==room_id, Bed.active==True).order_by(desc(Bed.created_at)).limit(20).all())
+    timed("free beds of the live dorm (db fallback)", lambda: db.query(Bed.id)
+          .join(Room, Bed.room_id==Room.id).join(Dorm, Room.dorm_id==Dorm.id)
+          .filter(Bed.active==True, Bed.blocked==False, Bed.allocated==False, Room.active==True,
+                  Dorm.active==True, remaining_beds_expression() > 0, Room.dorm_id==dorm_id)
+          .limit(10).all())
+
+
+def main(past_events):
+    with SessionLocal() as db:
+        started = time.perf_counter()
+        for year in range(past_events):
+            event(db, f'benchmark past {year}', False, datetime.utcnow() - timedelta(days=365 * (year + 1)))
+        dorm_id = event(db, 'benchmark live', True, datetime.utcnow())
+        room_id = db.execute(text('SELECT id FROM room WHERE dorm_id = :dorm LIMIT 1'), {'dorm': dorm_id}).scalar()
+        print(f"populated {past_events} past events and a live one, "
+              f"{(past_events + 1) * ROOMS * BEDS_PER_ROOM} beds, {time.perf_counter() - started:.1f}s")
+        measure(db, dorm_id, room_id)
+
+        started = time.perf_counter()
+        moved = 0
+        for level in LEVELS:
+            while True:
+                count = archive_chunk(db, level, datetime.utcnow() - timedelta(days=30), 5000)
+                moved += count
+                if count < 5000:
+                    break
+        print(f"archived {moved} rows in {time.perf_counter() - started:.1f}s")
+        # dead entries of the full indexes are only reclaimed by vacuum, not possible in this transaction
+        measure(db, dorm_id, room_id)
+        db.rollback()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,192 @@
+'''
+is_authenticated against a local fake auth service with injected latency.
+
+    python benchmarks/auth.py [concurrent requests]
+
+Compares the previous blocking dependency (run in the threadpool) with the
+async one, then checks request coalescing, the verified token cache, the
+circuit breaker on a hanging auth service and local verification of signed
+tokens. Fails with an AssertionError when any of them misbehaves. No
+database needed.
+'''
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+PORT = free_port()
+os.environ["MYSRCM_URL"] = f"http://127.0.0.1:{PORT}/"
+os.environ["AUTH_READ_TIMEOUT"] = "0.5"
+os.environ["AUTH_BREAKER_RESET"] = "2"
+# off by default, enabled to check it
+os.environ["AUTH_CACHE_TTL"] = "30"
+os.environ.pop("AUTH_JWKS_URL", None)
+
+import httpx
+import jwt
+import uvicorn
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Depends, FastAPI, HTTPException, Request, status
+
+import deps
+
+logging.getLogger('deps').setLevel(logging.ERROR)
+key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+class Upstream:
+    '''
+    The fake auth service, in its own process so it does not share the GIL
+    with the service under test. Latency and call count are shared values.
+    '''
+    def __init__(self, public_key):
+        self.latency = multiprocessing.Value('d', 0.0)
+        self.count = multiprocessing.Value('i', 0)
+        self.public_key = public_key.public_bytes(serialization.Encoding.PEM,
+                                                  serialization.PublicFormat.SubjectPublicKeyInfo)
+        self.process = multiprocessing.Process(target=self.serve, daemon=True)
+
+    @property
+    def calls(self):
+        return self.count.value
+
+    def reset(self, latency):
+        self.latency.value = latency
+        self.count.value = 0
+
+    def serve(self):
+        jwk = jwt.algorithms.RSAAlgorithm.to_jwk(serialization.load_pem_public_key(self.public_key), as_dict=True)
+        fake = FastAPI()
+
+        @fake.get("/api/v2/me/")
+        async def me():
+            with self.count.get_lock():
+                self.count.value += 1
+            await asyncio.sleep(self.latency.value)
+            return {"id": 1, "email": "user@example.org"}
+
+        @fake.get("/jwks.json")
+        async def jwks():
+            return {"keys": [dict(jwk, kid="key-1", use="sig")]}
+
+        uvicorn.run(fake, host='127.0.0.1', port=PORT, log_level='warning', backlog=4096)
+
+    def start(self):
+        self.process.start()
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/jwks.json")
+                return
+            except httpx.HTTPError:
+                time.sleep(0.1)
+
+upstream = None
+
+
+# the service side: the previous dependency and the current one
+def blocking_is_authenticated(request: Request):
+    resp = httpx.get(f"{os.environ['MYSRCM_URL']}api/v2/me/",
+                     headers={"Authorization": request.headers['Authorization']})
+    if resp.status_code != status.HTTP_200_OK:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED)
+    request.state.user = resp.json()
+    return True
+
+app = FastAPI()
+
+@app.get("/blocking")
+def read_blocking(request: Request, is_authenticated = Depends(blocking_is_authenticated)):
+    return request.state.user
+
+@app.get("/async")
+def read_async(request: Request, is_authenticated = Depends(deps.is_authenticated)):
+    return request.state.user
+
+
+async def burst(client, path, count, token=lambda i: f"token-{i}"):
+    upstream.reset(upstream.latency.value)
+    started = time.perf_counter()
+    responses = await asyncio.gather(*[client.get(path, headers={"Authorization": token(i)})
+                                       for i in range(count)])
+    elapsed = time.perf_counter() - started
+    codes = sorted({r.status_code for r in responses})
+    return elapsed, upstream.calls, codes
+
+
+async def main(count):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://service") as client:
+        upstream.reset(0.2)
+        print(f"{count} concurrent requests, auth service answering in 200ms:")
+        for label, path in [("blocking dependency in the threadpool", "/blocking"), ("async dependency", "/async")]:
+            elapsed, calls, codes = await burst(client, path, count)
+            print(f"  {label:<40} {elapsed:6.2f}s  {calls} upstream calls  {codes}")
+            assert codes == [200] and calls == count, (label, calls, codes)
+        deps.verified_tokens.clear()
+        elapsed, calls, codes = await burst(client, "/async", count, token=lambda i: "same-token")
+        print(f"  {'same token (coalesced)':<40} {elapsed:6.2f}s  {calls} upstream calls  {codes}")
+        assert codes == [200] and calls == 1, ("coalesced", calls, codes)
+        elapsed, calls, codes = await burst(client, "/async", count, token=lambda i: "same-token")
+        print(f"  {'same token again (cached)':<40} {elapsed:6.2f}s  {calls} upstream calls  {codes}")
+        assert codes == [200] and calls == 0, ("cached", calls, codes)
+
+        upstream.reset(10)
+        print("auth service hanging, read timeout 0.5s, sequential requests:")
+        latencies = []
+        for i in range(20):
+            started = time.perf_counter()
+            response = await client.get("/async", headers={"Authorization": f"hang-{i}"})
+            latencies.append((time.perf_counter() - started, response.status_code))
+        print("  " + " ".join(f"{elapsed * 1000:.0f}ms/{code}" for elapsed, code in latencies))
+        print(f"  {upstream.calls} upstream calls, breaker open: {deps.breaker.opened_at is not None}")
+        failures = deps.AUTH_BREAKER_FAILURES
+        assert all(code == 503 for _, code in latencies), latencies
+        # timed out until the breaker opens, rejected without a call after that
+        assert all(elapsed >= deps.AUTH_READ_TIMEOUT for elapsed, _ in latencies[:failures]), latencies
+        assert all(elapsed < 0.1 for elapsed, _ in latencies[failures:]), latencies
+        assert upstream.calls == failures and deps.breaker.opened_at is not None, upstream.calls
+        upstream.reset(0.2)
+        await asyncio.sleep(deps.AUTH_BREAKER_RESET)
+        response = await client.get("/async", headers={"Authorization": "recovered"})
+        print(f"  after {deps.AUTH_BREAKER_RESET:.0f}s: {response.status_code}, "
+              f"breaker open: {deps.breaker.opened_at is not None}")
+        assert response.status_code == 200 and deps.breaker.opened_at is None, response.status_code
+
+        deps.verifier = deps.JWKSVerifier(f"{os.environ['MYSRCM_URL']}jwks.json", ttl=3600, algorithms=["RS256"])
+        token = jwt.encode({"sub": "42", "email": "user@example.org", "exp": int(time.time()) + 600},
+                           key, algorithm="RS256", headers={"kid": "key-1"})
+        print(f"{count} concurrent requests with signed tokens, verified locally:")
+        elapsed, calls, codes = await burst(client, "/async", count, token=lambda i: f"Bearer {token}")
+        print(f"  {'signed token':<40} {elapsed:6.2f}s  {calls} upstream calls  {codes}")
+        assert codes == [200] and calls == 0, ("signed token", calls, codes)
+        response = await client.get("/async", headers={"Authorization": f"Bearer {token}"})
+        assert response.json()["id"] == "42", response.json()
+        expired = jwt.encode({"sub": "42", "exp": int(time.time()) - 10}, key, algorithm="RS256",
+                             headers={"kid": "key-1"})
+        elapsed, calls, codes = await burst(client, "/async", 10, token=lambda i: f"Bearer {expired}")
+        print(f"  {'expired token':<40} {elapsed:6.2f}s  {calls} upstream calls  {codes}")
+        assert codes == [401] and calls == 0, ("expired token", calls, codes)
+        # tokens not signed by a published key still go to the auth service
+        elapsed, calls, codes = await burst(client, "/async", 10, token=lambda i: f"Bearer opaque-{i}")
+        print(f"  {'opaque token':<40} {elapsed:6.2f}s  {calls} upstream calls  {codes}")
+        assert codes == [200] and calls == 10, ("opaque token", calls, codes)
+        await deps.close_client()
+        print("all checks passed")
+
+
+if __name__ == '__main__':
+    upstream = Upstream(key.public_key())
+    upstream.start()
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else deps.AUTH_MAX_CONNECTIONS))
+    upstream.process.terminate()
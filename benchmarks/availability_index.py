@@ -0,0 +1,101 @@
+'''
+Memory footprint and lookup latency of the in-memory availability index.
+
+    python benchmarks/availability_index.py [number of beds]
+
+Builds the index from synthetic rows (no database needed): 40 beds per room,
+100 rooms per dorm, about a third of the beds allocated or blocked.
+'''
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+os.environ.setdefault("DB_STRING", "sqlite://")
+
+from availability import AvailabilityIndex
+from models import Bed, Room
+
+BEDS_PER_ROOM = 40
+ROOMS_PER_DORM = 100
+
+
+def rows(count):
+    rng = random.Random(42)
+    for room_number in range((count + BEDS_PER_ROOM - 1) // BEDS_PER_ROOM):
+        if room_number % ROOMS_PER_DORM == 0:
+            dorm_id = uuid.uuid4()
+        room_id = uuid.uuid4()
+        room = (rng.random() < 0.3, rng.choice(list(Room.FLOORS)).value, rng.random() < 0.5,
+                rng.random() < 0.5, rng.choice(list(Room.BED_TYPES)).value,
+                rng.choice(list(Room.PARTICIPANT_TYPES)).value)
+        for number in range(min(BEDS_PER_ROOM, count - room_number * BEDS_PER_ROOM)):
+            yield (uuid.uuid4(), room_id, True, rng.random() < 0.05, rng.random() < 0.3,
+                   dorm_id, True, True, 100) + room \
+                + (Bed.LEVELS.LOWER.value if number % 2 else Bed.LEVELS.UPPER.value,
+                   rng.random() < 0.2, rng.random() < 0.2)
+
+
+def footprint(index):
+    # everything the index keeps per bed, room, dorm and bitset
+    size = sys.getsizeof(index.ids) + sys.getsizeof(index.slot_room) + sys.getsizeof(index.slot_flags)
+    size += sys.getsizeof(index.free) + sum(sys.getsizeof(block) for block in index.free)
+    size += sys.getsizeof(index.room_attributes) + sum(sys.getsizeof(a) for a in index.room_attributes)
+    size += sys.getsizeof(index.room_percent) + sys.getsizeof(index.room_beds) + sys.getsizeof(index.room_allocated)
+    for blocks in index.bits.values():
+        size += sys.getsizeof(blocks) + sum(sys.getsizeof(block) for block in blocks)
+    for ids, lookup, slots in [(index.room_ids, index.room_index, index.room_slots),
+                               (index.dorm_ids, index.dorm_index, index.dorm_slots)]:
+        size += sys.getsizeof(ids) + sys.getsizeof(lookup) + sys.getsizeof(slots)
+        size += sum(sys.getsizeof(i) + sys.getsizeof(i.int) for i in ids)
+        size += sum(sys.getsizeof(r) + sum(sys.getsizeof(p) + 2 * 28 for p in r) for r in slots)
+    return size
+
+
+def timed(label, function, repeat=2000):
+    function()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"{label:<60} {elapsed * 1e6:10.1f} us")
+
+
+def main(count):
+    data = list(rows(count))
+    started = time.perf_counter()
+    index = AvailabilityIndex.from_rows(data)
+    build = time.perf_counter() - started
+    del data
+    print(f"beds: {index.size}, rooms: {len(index.room_ids)}, dorms: {len(index.dorm_ids)}")
+    print(f"build: {build:.2f}s, index memory: {footprint(index) / 2**20:.1f} MiB")
+
+    dorm_id = index.dorm_ids[len(index.dorm_ids) // 2]
+    room_id = index.room_ids[len(index.room_ids) // 2]
+    timed("any free bed", lambda: index.find(limit=1))
+    timed("10 free lower beds close to bath", lambda: index.find(level='lower', close_to_bath=True))
+    timed("10 lower beds near bath, sisters only, AC",
+          lambda: index.find(level='lower', close_to_bath=True, participant_type='sisters_only',
+                             ac_available=True))
+    timed("same, within one dorm",
+          lambda: index.find(dorm_id=dorm_id, level='lower', close_to_bath=True,
+                             participant_type='sisters_only', ac_available=True))
+    timed("free beds of one room", lambda: index.find(room_id=room_id, limit=40))
+    timed("no match (scans every block)",
+          lambda: index.find(bed_type='wood', floor='ff', participant_type='overseas_only',
+                             ac_available=True, room_close_to_bath=True, room_close_to_dorm_entrance=True,
+                             level='lower', close_to_bath=True, close_to_dorm_entrance=True), repeat=200)
+    bed_id, room, _ = index.find(room_id=room_id, limit=1)[0]
+    bed = {'id': bed_id, 'room_id': room, 'active': True, 'blocked': False, 'level': 'lower',
+           'close_to_bath': True, 'close_to_dorm_entrance': False}
+    flip = [False]
+    def update():
+        flip[0] = not flip[0]
+        index.update_bed(dict(bed, allocated=flip[0]))
+    timed("allocate/release one bed (write hook)", update)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,115 @@
+'''
+Bytes on the wire and server CPU per page of the list endpoints, with and
+without `fields=` and response compression, against a real Postgres.
+
+    DB_STRING=postgresql://... python benchmarks/payload.py [requests per case]
+
+Drives the ASGI app directly, so the CPU measured is the service's own:
+routing, queries, serialization and compression. Authentication is
+stubbed. Data is created inside a transaction that is rolled back at the end.
+'''
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ.setdefault("MYSRCM_URL", "http://auth.invalid/")
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import deps
+from config.db import engine, get_db
+from main import app
+
+ROOMS = 100
+BEDS = 100
+ENCODINGS = [('identity', 'identity'), ('gzip', 'gzip'), ('br', 'br, gzip')]
+
+
+def populate(db):
+    dorm_id = db.execute(text('''
+        INSERT INTO dorm (id, name, type, amount, amount_for, active, created_at, updated_at)
+        VALUES (gen_random_uuid(), 'benchmark payload', 'east_bunk_bed', 0, 'event', true, now(), now())
+        RETURNING id
+    ''')).scalar()
+    db.execute(text('''
+        INSERT INTO room (id, name, dorm_id, room_identifier, ac_available, floor, close_to_dorm_entrance,
+                          close_to_bath, percent_released, bed_type, is_multibatch, max_count, participant_type,
+                          reset_allowed, active, bed_count, allocated_count, created_at, updated_at)
+        SELECT gen_random_uuid(), 'room ' || n, :dorm, n, false, 'gf', false, n % 2 = 0, 100, 'bunk', false, 0,
+               'general', false, true, 0, 0, now(), now()
+        FROM generate_series(1, :rooms) AS n
+    '''), {'dorm': dorm_id, 'rooms': ROOMS})
+    room_id = db.execute(text('SELECT id FROM room WHERE dorm_id = :dorm LIMIT 1'), {'dorm': dorm_id}).scalar()
+    db.execute(text('''
+        INSERT INTO bed (id, name, room_id, number, level, close_to_dorm_entrance, close_to_bath,
+                         allocated, blocked, active, created_at, updated_at)
+        SELECT gen_random_uuid(), 'bed ' || n, :room, n, 'lower', false, false, n % 3 = 0, false, true, now(), now()
+        FROM generate_series(1, :beds) AS n
+    '''), {'room': room_id, 'beds': BEDS})
+    return dorm_id, room_id
+
+
+async def get(path, query, accept_encoding):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': 'GET', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': query.encode(), 'server': ('service', 80), 'client': ('127.0.0.1', 1),
+        'headers': [(b'authorization', b'benchmark'), (b'x-client-id', b'benchmark'),
+                    (b'accept-encoding', accept_encoding.encode())],
+    }
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    assert sent[0]['status'] == 200, sent
+    return sum(len(message.get('body', b'')) for message in sent[1:])
+
+
+async def measure(label, path, query, accept_encoding, repeat):
+    size = await get(path, query, accept_encoding)
+    started, cpu = time.perf_counter(), time.process_time()
+    for _ in range(repeat):
+        await get(path, query, accept_encoding)
+    elapsed = (time.perf_counter() - started) / repeat
+    cpu = (time.process_time() - cpu) / repeat
+    print(f"  {label:<40} {size:8d} bytes  {cpu * 1000:7.2f}ms cpu  {elapsed * 1000:7.2f}ms")
+
+
+async def main(repeat):
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        dorm_id, room_id = populate(Session(bind=connection))
+
+        def get_benchmark_db():
+            # commits of the endpoints become savepoints of the outer transaction
+            db = Session(bind=connection, join_transaction_mode="create_savepoint")
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = get_benchmark_db
+        app.dependency_overrides[deps.is_authenticated] = lambda: True
+        cases = [
+            (f"{ROOMS} rooms", f"/dorms/{dorm_id}/rooms/", "page_size=100", "name,floor,bed_count"),
+            (f"{BEDS} beds", f"/dorms/{dorm_id}/rooms/{room_id}/beds/", "page_size=100", "number,allocated"),
+        ]
+        for label, path, query, fields in cases:
+            print(f"{label}, one page:")
+            for projection, page_query in [("all fields", query), (f"fields={fields}", f"{query}&fields={fields}")]:
+                for encoding, accept_encoding in ENCODINGS:
+                    await measure(f"{projection}, {encoding}", path, page_query, accept_encoding, repeat)
+        transaction.rollback()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
@@ -0,0 +1,102 @@
+'''
+Release waves and quota checks at venue scale, against a real Postgres.
+
+    DB_STRING=postgresql://... python benchmarks/release_wave.py [number of rooms]
+
+Fills the tables of a migrated database with synthetic dorms, rooms and
+beds (40 beds per room, 100 rooms per dorm) inside a transaction that is
+rolled back at the end, so the database is left as it was.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from sqlalchemy import text
+
+from config.db import SessionLocal
+from models import Bed, Room
+from quota import release_wave, released_beds
+
+BEDS_PER_ROOM = 40
+ROOMS_PER_DORM = 100
+
+
+def populate(db, rooms):
+    db.execute(text('''
+        INSERT INTO dorm (id, name, type, amount, amount_for, active)
+        SELECT gen_random_uuid(), 'benchmark ' || n, 'east_bunk_bed', 0, 'event', true
+        FROM generate_series(1, :dorms) AS n
+    '''), {'dorms': (rooms + ROOMS_PER_DORM - 1) // ROOMS_PER_DORM})
+    db.execute(text('''
+        INSERT INTO room (id, name, dorm_id, room_identifier, floor, bed_type, participant_type,
+                          percent_released, active, bed_count, allocated_count)
+        SELECT gen_random_uuid(), 'room ' || n, dorm.id, n, 'gf', 'bunk',
+               CASE WHEN n % 2 = 0 THEN 'sisters_only' ELSE 'general' END::participant_type,
+               50, true, :beds, 0
+        FROM (SELECT id, row_number() OVER () - 1 AS position FROM dorm WHERE name LIKE 'benchmark %') AS dorm,
+             generate_series(1, :per_dorm) AS n
+        WHERE dorm.position * :per_dorm + n <= :rooms
+    '''), {'rooms': rooms, 'per_dorm': ROOMS_PER_DORM, 'beds': BEDS_PER_ROOM})
+    db.execute(text('''
+        INSERT INTO bed (id, name, room_id, number, level, allocated, blocked, active)
+        SELECT gen_random_uuid(), 'bed ' || n, room.id, n, 'lower', false, false, true
+        FROM room JOIN dorm ON dorm.id = room.dorm_id, generate_series(1, :beds) AS n
+        WHERE dorm.name LIKE 'benchmark %'
+    '''), {'beds': BEDS_PER_ROOM})
+    db.execute(text('ANALYZE dorm; ANALYZE room; ANALYZE bed'))
+
+
+def timed(label, function, count=1):
+    started = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started
+    per = f", {elapsed / count * 1e6:.0f}us each" if count > 1 else ''
+    print(f"{label:<50} {elapsed * 1000:9.1f}ms{per}")
+    return result
+
+
+def allocate(db, room_id, bed_id):
+    # what the allocate endpoint does, without the commit
+    room = db.query(Room).filter(Room.id==room_id).with_for_update().one()
+    bed = db.query(Bed).filter(Bed.id==bed_id).with_for_update().one()
+    if room.allocated_count >= released_beds(room.bed_count, room.percent_released):
+        return False
+    bed.allocated = True
+    db.flush()
+    return True
+
+
+def main(rooms):
+    with SessionLocal() as db:
+        timed(f"populate {rooms} rooms, {rooms * BEDS_PER_ROOM} beds", lambda: populate(db, rooms))
+        room_ids = [id for id, in db.execute(text(
+            "SELECT room.id FROM room JOIN dorm ON dorm.id = room.dorm_id WHERE dorm.name LIKE 'benchmark %'"))]
+        dorm_ids = [id for id, in db.execute(text("SELECT id FROM dorm WHERE name LIKE 'benchmark %'"))]
+
+        updated = timed("wave: every room of the venue", lambda: release_wave(db, 60, dorm_ids=dorm_ids))
+        print(f"  {len(updated)} rooms")
+        updated = timed("wave: one participant type", lambda: release_wave(
+            db, 70, dorm_ids=dorm_ids, participant_type='sisters_only'))
+        print(f"  {len(updated)} rooms")
+        wave = {id: 10 + i % 90 for i, id in enumerate(room_ids)}
+        updated = timed("wave: a percentage per room", lambda: release_wave(db, rooms=wave))
+        print(f"  {len(updated)} rooms")
+
+        sample = room_ids[:2000]
+        def one_by_one():
+            for id in sample:
+                db.execute(text('UPDATE room SET percent_released = 80 WHERE id = :id'), {'id': id})
+        timed("row by row, 2000 rooms (for comparison)", one_by_one, count=len(sample))
+
+        beds = db.execute(text('SELECT room_id, id FROM bed WHERE room_id = ANY(:rooms)'),
+                          {'rooms': room_ids[:50]}).all()
+        allocated = timed("allocate with quota check", lambda: sum(allocate(db, *bed) for bed in beds),
+                          count=len(beds))
+        print(f"  {allocated} of {len(beds)} beds allocated, the rest over quota")
+        db.rollback()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 25_000)